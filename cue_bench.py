@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" cue tools library (benchmarks) """
+
+import os
+import sys
+import time
+import random
+import argparse
+
+import cuelib
+
+
+WORDS = (u"love", u"night", u"river", u"blue", u"dream", u"fire", u"stone", u"road", u"rain", u"heart",
+         u"ночь", u"река", u"звезда", u"дорога", u"сердце", u"ветер", u"город", u"песня")
+
+
+def mk_cue(rnd, tracks=None, image=None):
+    """ make synthetic .cue (unicode): image or per-track files, random REMs, quotes & indentation
+
+        :param rnd: random.Random()
+        :param tracks: total tracks (None - random)
+        :param image: one file for all tracks (None - random)
+        :return: unicode
+    """
+
+    def words(n=3):
+        """"""
+
+        return u" ".join(rnd.choice(WORDS) for _ in xrange(rnd.randint(1, n))).title()
+    #
+
+    tracks = tracks or rnd.randint(4, 20)
+    image = rnd.random() < 0.5 if image is None else image
+    indent = rnd.choice((u"  ", u"    ", u"\t"))
+
+    out = [u'REM GENRE "%s"' % words(1), u"REM DATE %d" % rnd.randint(1960, 2020),
+           u'REM DISCID %08X' % rnd.getrandbits(32), u'REM COMMENT "ExactAudioCopy v1.0b3"']
+    performer = words()
+    out.append(u'PERFORMER "%s"' % performer)
+    out.append(u'TITLE "%s"' % words())
+
+    if image:
+        out.append(u'FILE "%s - %s.flac" WAVE' % (performer, words()))
+    #
+
+    offset = 0
+    for n in xrange(1, tracks + 1):
+        if not image:
+            out.append(u'FILE "%02d - %s.flac" WAVE' % (n, words()))
+        #
+        out.append(u"%sTRACK %02d AUDIO" % (indent, n))
+        out.append(u'%sTITLE "%s"' % (indent * 2, words()))
+        out.append(u'%sPERFORMER "%s"' % (indent * 2, performer))
+        if rnd.random() < 0.3:
+            out.append(u"%sISRC %s" % (indent * 2, u"".join(rnd.choice(u"ABCDEFGHIJ0123456789") for _ in xrange(12))))
+        #
+        if image:
+            if n > 1 and rnd.random() < 0.3:
+                out.append(u"%sINDEX 00 %s" % (indent * 2, cuelib.cue_build_timestamp(offset)))
+                offset += rnd.randint(1, 150)
+            #
+            out.append(u"%sINDEX 01 %s" % (indent * 2, cuelib.cue_build_timestamp(offset)))
+            offset += rnd.randint(75 * 60, 75 * 600)
+        else:
+            out.append(u"%sINDEX 01 00:00:00" % (indent * 2))
+        #
+    #
+
+    return u"\r\n".join(out) + u"\r\n"
+#
+
+
+def mk_corpus(total=1000, seed=0, per_dir=10):
+    """ make corpus of synthetic .cue (encoded as cp1251, utf-8 with/without BOM, utf-16),
+        encoding is the same for per_dir .cue (as for folder of write_corpus())
+
+        :param total: total .cue
+        :param seed: random seed
+        :param per_dir: total .cue with the same encoding
+        :return: list of (name, data)
+    """
+
+    rnd = random.Random(seed)
+    encodings = (("cp1251", ""), ("utf-8", ""), ("utf-8", cuelib.BOM_UTF8), ("utf-16le", cuelib.BOM_UTF16LE))
+    corpus = []
+
+    for n in xrange(total):
+        encoding, bom = encodings[n // per_dir % len(encodings)]
+        corpus.append(("disc%06d_%s.cue" % (n, encoding), bom + mk_cue(rnd).encode(encoding)))
+    #
+
+    return corpus
+#
+
+
+def write_corpus(path, corpus, per_dir=10):
+    """ write corpus into folder (per_dir .cue per sub-folder)
+
+        :param path:
+        :param corpus: list of (name, data)
+        :param per_dir: total .cue per sub-folder
+    """
+
+    for n, (name, data) in enumerate(corpus):
+        d_name = os.path.join(path, "artist%03d" % (n // per_dir // 100), "album%05d" % (n // per_dir))
+        if not os.path.isdir(d_name):
+            os.makedirs(d_name)
+        #
+        with open(os.path.join(d_name, name), "wb") as f:
+            f.write(data)
+        #
+    #
+#
+
+
+def timeit(fn, items, repeat=3):
+    """ best time of fn() over items
+
+        :param fn:
+        :param items:
+        :param repeat:
+    """
+
+    best = None
+    for _ in xrange(repeat):
+        tt = time.time()
+        for item in items:
+            fn(item)
+        #
+        tt = time.time() - tt
+        best = tt if best is None else min(best, tt)
+    #
+
+    return best
+#
+
+
+def bench_parse(args):
+    """ compare legacy (multi-pass) and single-pass parser (decoded data & with encoding detection)
+
+        :param args:
+    """
+
+    corpus = mk_corpus(args.total)
+    texts = [cuelib.as_unicode(data)[0] for _, data in corpus]
+    print("corpus cue{%r} bytes{%r}" % (len(corpus), sum(len(data) for _, data in corpus)))
+
+    # same result
+    for text in texts:
+        old, new = cuelib.cue_parse_legacy(text), cuelib.cue_parse(text)
+        if old.hex_sign(False, False, False) != new.hex_sign(False, False, False):
+            print("error: different result {%r}" % text)
+            return 1
+        #
+    #
+
+    for title, items in (("text", texts), ("bytes", [data for _, data in corpus])):
+        for name, fn in (("legacy", cuelib.cue_parse_legacy), ("parser", cuelib.cue_parse)):
+            tt = timeit(fn, items, repeat=1 if title == "bytes" else 3)
+            print("%-6s %-6s time{%7.3f} cue/s{%9.1f}" % (title, name, tt, len(items) / tt))
+        #
+    #
+
+    return 0
+#
+
+
+def legacy_as_unicode(data, default='cp1251'):
+    """ as_unicode() before tiered detection (chardet over all data)
+
+        :param data:
+        :param default:
+    """
+
+    encoding = cuelib.chardet.detect(data).get('encoding', default)
+    if encoding in ("MacCyrillic",):
+        encoding = default
+    #
+
+    for bom in (cuelib.BOM_UTF8, cuelib.BOM_UTF16LE, cuelib.BOM_UTF16BE):
+        if data.startswith(bom):
+            data = data[len(bom):]
+            break
+        #
+    #
+
+    return unicode(data, encoding), encoding
+#
+
+
+def bench_encoding(args):
+    """ encoding detection: legacy (chardet over all data) vs tiered (with/without folder memo),
+        time & total wrong decoded .cue
+
+        :param args:
+    """
+
+    per_dir = 10
+    corpus = mk_corpus(args.total, per_dir=per_dir)
+    texts = []
+    for name, data in corpus:
+        encoding = name.rsplit("_", 1)[1][:-4]
+        bom = "".join(bom for bom in (cuelib.BOM_UTF8, cuelib.BOM_UTF16LE) if data.startswith(bom))
+        texts.append(data[len(bom):].decode(encoding))
+    #
+    print("corpus cue{%r} (cp1251, utf-8, utf-8 BOM, utf-16le BOM)" % len(corpus))
+
+    def tiered_memo(n, data):
+        """ tiered with memo by folder """
+
+        folder = n // per_dir
+        text, encoding = cuelib.as_unicode(data, hint=memo.get(folder))
+        if not encoding.startswith("utf") and encoding != "ascii":
+            memo[folder] = encoding
+        #
+        return text
+    #
+
+    for title, fn in (("legacy", lambda n, data: legacy_as_unicode(data)[0]),
+                      ("tiered", lambda n, data: cuelib.as_unicode(data)[0]),
+                      ("memo", tiered_memo)):
+        memo = {}
+        wrong = 0
+        tt = time.time()
+        for n, (_, data) in enumerate(corpus):
+            try:
+                wrong += fn(n, data) != texts[n]
+            except UnicodeError:
+                wrong += 1
+            #
+        #
+        tt = time.time() - tt
+        print("%-6s time{%7.3f} cue/s{%9.1f} wrong{%d}" % (title, tt, len(corpus) / tt, wrong))
+    #
+
+    return 0
+#
+
+
+def main():
+    """
+        :return:
+    """
+
+    parser = argparse.ArgumentParser(description="cue tools library (benchmarks)")
+    parser.add_argument('bench', help='benchmark', choices=("parse", "encoding", "corpus"))
+    parser.add_argument('--total', help='total .cue in corpus', type=int, default=1000, action="store")
+    parser.add_argument('--out', help='folder for corpus (for corpus)', type=str, action="store")
+    args = parser.parse_args()
+
+    if args.bench == "parse":
+        return bench_parse(args)
+    elif args.bench == "encoding":
+        return bench_encoding(args)
+    elif args.bench == "corpus":
+        if not args.out:
+            print("error: 'corpus' needs '--out'")
+            return 1
+        #
+        write_corpus(args.out, mk_corpus(args.total))
+    #
+
+    return 0
+#
+
+if __name__ == "__main__":
+    sys.exit(main())
+#
@@ -3,7 +3,14 @@
 
 """ cue tools library """
 
+import os
+import re
+import sys
 import time
+import sqlite3
+import itertools
+import functools
+import multiprocessing
 from binascii import hexlify
 from hashlib import sha256 as hash_func
 import chardet
@@ -21,6 +28,22 @@ import chardet
 BOM_UTF8 = '\xef\xbb\xbf'
 BOM_UTF16LE = '\xff\xfe'
 BOM_UTF16BE = '\xfe\xff'
+BOM_UTF32LE = '\xff\xfe\x00\x00'
+BOM_UTF32BE = '\x00\x00\xfe\xff'
+
+# BOM -> encoding (UTF-32 before UTF-16)
+BOMS = ((BOM_UTF32LE, 'utf-32-le'), (BOM_UTF32BE, 'utf-32-be'), (BOM_UTF8, 'utf-8'), (BOM_UTF16LE, 'utf-16-le'),
+        (BOM_UTF16BE, 'utf-16-be'))
+
+# lines with non-ascii bytes (sample for chardet)
+NON_ASCII_LINE = re.compile(r'[^\n]*[\x80-\xff][^\n]*')
+
+# detected encodings by folder (see cue_load())
+ENCODING_MEMO = {}
+
+
+# signature variant -> (ignore_head, ignore_files, ignore_tracks), 7 - default (all ignored)
+SIGN_VARIANTS = [(variant, (bool(variant & 4), bool(variant & 2), bool(variant & 1))) for variant in xrange(8)]
 
 
 class CueError(ValueError):
@@ -340,6 +363,37 @@ class Cue(object):
         return hexlify(self.sign(ignore_head, ignore_files, ignore_tracks)).upper()
     #
 
+    def hex_signs(self):
+        """ return cue-signatures of all variants (see SIGN_VARIANTS)
+
+            :return: list of (variant, hex-signature)
+        """
+
+        return [(variant, self.hex_sign(*flags)) for variant, flags in SIGN_VARIANTS]
+    #
+
+    def toc(self):
+        """ return TOC: offsets of tracks (INDEX 01 or first index, in frames) relative to first track
+            (None - tracks aren't in one file)
+
+            :return: list of frames
+        """
+
+        if not self.tracks or len(set(trk.file for trk in self.tracks)) != 1:
+            return None
+        #
+
+        starts = []
+        for trk in self.tracks:
+            if not trk.indexes:
+                return None
+            #
+            starts.append(next((idx.time for idx in trk.indexes if idx.name == '01'), trk.indexes[0].time))
+        #
+
+        return [start - starts[0] for start in starts]
+    #
+
     def check(self):
         """ check cue
 
@@ -406,12 +460,16 @@ class Cue(object):
 #
 
 
-def as_unicode(data, default='cp1251', strict=False):
+def as_unicode(data, default='cp1251', strict=False, hint=None):
     """ return unicode data and encoding (and cutoff BOM)
 
+        encoding is detected by tiers (see detect_encoding()): BOM, ascii/utf-8/utf-16 (without BOM),
+        hint, chardet over sample of non-ascii lines
+
         :param data:
         :param default:
         :param strict: use mode
+        :param hint: encoding to try before chardet (e.g. encoding of other .cue of folder)
         :return: unicode-data, encoding-as-string
     """
 
@@ -420,29 +478,86 @@ def as_unicode(data, default='cp1251', strict=False):
         return data, ''
     #
 
+    encoding = None
+    for bom, bom_encoding in BOMS:
+        if data.startswith(bom):
+            # cutoff BOM
+            data = data[len(bom):]
+            encoding = bom_encoding
+            break
+        #
+    #
+
     if strict:
         encoding = default
-    else:
-        encoding = chardet.detect(data).get('encoding', default)
-        if encoding in ("MacCyrillic",):
-            encoding = default
+    elif not encoding:
+        encoding = detect_encoding(data, default, hint)
+    #
+
+    return unicode(data, encoding), encoding
+#
+
+
+def sample_non_ascii(data, limit=4096):
+    """ return sample of lines with non-ascii bytes
+
+        :param data:
+        :param limit: max size of sample
+    """
+
+    sample = []
+    size = 0
+
+    for m in NON_ASCII_LINE.finditer(data):
+        sample.append(m.group())
+        size += len(sample[-1])
+        if size >= limit:
+            break
         #
     #
 
-    if data.startswith(BOM_UTF8):
-        _skip = len(BOM_UTF8)
-    elif data.startswith(BOM_UTF16LE) or data.startswith(BOM_UTF16BE):
-        _skip = len(BOM_UTF16BE)
-    else:
-        _skip = 0
+    return "\n".join(sample)
+#
+
+
+def detect_encoding(data, default='cp1251', hint=None):
+    """ detect encoding of data (without BOM): ascii or strict utf-8, utf-16 (by zeros), hint (if can decode),
+        chardet over sample of non-ascii lines, default
+
+        :param data:
+        :param default:
+        :param hint:
+        :return: encoding
+    """
+
+    head = data[:4096]
+    if '\x00' in head:
+        return 'utf-16-be' if head[0::2].count('\x00') > head[1::2].count('\x00') else 'utf-16-le'
     #
 
-    # cutoff BOM
-    if _skip:
-        data = data[_skip:]
+    for encoding in ('ascii', 'utf-8', hint):
+        if encoding:
+            try:
+                data.decode(encoding)
+                return encoding
+            except (UnicodeError, LookupError):
+                pass
+            #
+        #
     #
 
-    return unicode(data, encoding), encoding
+    encoding = chardet.detect(sample_non_ascii(data)).get('encoding') or default
+    if encoding in ("MacCyrillic",) or encoding.lower() in ('ascii', 'utf-8'):
+        return default
+    #
+
+    try:
+        data.decode(encoding)
+    except (UnicodeError, LookupError):
+        return default
+    #
+
+    return encoding
 #
 
 
@@ -680,8 +795,8 @@ def cue_parse_track(cue, data):
 #
 
 
-def cue_parse(data, encoding="cp1251"):
-    """ parse .cue from string and return Cue()
+def cue_parse_legacy(data, encoding="cp1251"):
+    """ parse .cue from string and return Cue() (multi-pass parser, reference for cue_parse())
 
         :param data:
         :param encoding:
@@ -754,6 +869,239 @@ def cue_parse(data, encoding="cp1251"):
 #
 
 
+def cue_split(data):
+    """ split data into (first value, rest), first value can be quoted (with spaces)
+
+        :param data:
+        :return:
+    """
+
+    if data.startswith('"'):
+        end = data.find('"', 1)
+        if end > 0:
+            return data[1:end].strip(), cue_normalize(data[end + 1:])
+        #
+    #
+
+    d = data.split(None, 1)
+    if len(d) != 2:
+        raise CueError('invalid format: %r' % data)
+    #
+
+    return cue_normalize(d[0]), cue_normalize(d[1])
+#
+
+
+def cue_split_last(data):
+    """ split data into (value, last word), value can be quoted (with spaces)
+
+        :param data:
+        :return:
+    """
+
+    if data.startswith('"'):
+        end = data.rfind('"')
+        if end > 0:
+            return data[1:end].strip(), data[end + 1:].strip()
+        #
+    #
+
+    d = data.rsplit(None, 1)
+    if len(d) != 2:
+        raise CueError('invalid: {%r}' % data)
+    #
+
+    return cue_normalize(d[0]), d[1]
+#
+
+
+# line tokenizer: keyword, quoted value (whole rest of line in quotes) or rest of line
+CUE_LINE = re.compile(r'^[ \t]*(\S+)[ \t]*(?:"(.*)"|(.*?))[ \t]*\r?$', re.M | re.U)
+
+
+class CueParser(object):
+    """ single-pass cue parser: tokenized lines are dispatched by keyword table of state (head or track),
+        Cue()/CueFile()/CueTrack()/CueIndex() are built directly
+    """
+
+    def __init__(self, lenient=False):
+        """
+            :param lenient: skip unknown keywords and invalid lines (instead of CueError)
+        """
+
+        self.lenient = lenient
+        self.cue = Cue()
+        self.cue.rems({})
+
+        self.table = self.HEAD  # keyword table of state
+        self.target = self.cue  # object for attributes & REMs
+        self.track = None  # current track
+        self.tracks = []
+    #
+
+    def parse(self, data):
+        """ parse data
+
+            :param data: unicode
+        """
+
+        table, target = self.table, self.target
+
+        for keyword, quoted, value in CUE_LINE.findall(data):
+            entry = table.get(keyword) or table.get(keyword.upper())
+
+            if entry is None:
+                if self.lenient:
+                    continue
+                #
+                raise CueError('unknown param %r' % keyword)
+            #
+
+            attr, handler = entry
+
+            if attr:
+                # simple attribute
+                if quoted:
+                    value = quoted.strip()
+                elif '\t' in value or value[:1] == "'":
+                    value = cue_normalize(value)
+                #
+                setattr(target, attr, value)
+                continue
+            #
+
+            try:
+                handler(self, '"%s"' % quoted if quoted else value)
+            except ValueError, e:
+                if not self.lenient:
+                    raise CueError('invalid: {%r %r} (%s)' % (keyword, quoted or value, e))
+                #
+            #
+            table, target = self.table, self.target
+        #
+
+        return self
+    #
+
+    def close(self):
+        """ finish parsing and return Cue()
+
+            :return:
+        """
+
+        self.end_track()
+        cue = self.cue
+
+        if not (cue.performer or cue.title or cue.catalog or cue.rems()):
+            raise CueError('empty head')
+        #
+
+        if not cue.files:
+            raise CueError('no file(s)')
+        #
+
+        if not self.tracks:
+            raise CueError('no track(s)')
+        #
+
+        for trk in self.tracks:
+            if not trk.indexes:
+                raise CueError('no track index(-es)')
+            #
+            if not trk.performer:
+                trk.performer = cue.performer
+            #
+        #
+
+        cue.tracks = self.tracks
+        return cue
+    #
+
+    def end_track(self):
+        """ save current track (track without attributes is skipped) """
+
+        trk = self.track
+        if trk and (trk.indexes or trk.title or trk.performer or trk.isrc or trk.flags or trk.rems()):
+            self.tracks.append(trk)
+        #
+    #
+
+    def on_rem(self, rest):
+        """ REM name value """
+
+        name, value = cue_split(rest)
+        self.target.rems()[name] = value
+    #
+
+    def on_file(self, rest):
+        """ FILE "name" type """
+
+        self.cue.files.append(CueFile(*cue_split_last(rest)))
+    #
+
+    def on_track(self, rest):
+        """ TRACK id type (state: track) """
+
+        tr_id, tr_type = rest.split()
+        self.end_track()
+
+        self.track = CueTrack(id=tr_id, type=tr_type, file=len(self.cue.files) - 1)
+        self.track.rems({})
+        self.table = self.TRACK
+        self.target = self.track
+    #
+
+    def on_index(self, rest):
+        """ INDEX id mm:ss:ff """
+
+        idx_id, data = rest.split()
+        self.track.indexes.append(CueIndex(idx_id, data))
+    #
+
+    # keyword -> (attribute, handler) by state
+    HEAD = {
+        "PERFORMER": ("performer", None),
+        "TITLE": ("title", None),
+        "CATALOG": ("catalog", None),
+        "REM": (None, on_rem),
+        "FILE": (None, on_file),
+        "TRACK": (None, on_track),
+    }
+
+    TRACK = {
+        "PERFORMER": ("performer", None),
+        "TITLE": ("title", None),
+        "ISRC": ("isrc", None),
+        "FLAGS": ("flags", None),
+        "INDEX": (None, on_index),
+        "REM": (None, on_rem),
+        "FILE": (None, on_file),
+        "TRACK": (None, on_track),
+    }
+#
+
+
+def cue_parse(data, encoding="cp1251", lenient=False, hint=None):
+    """ parse .cue from string and return Cue() (single pass, see CueParser())
+
+        :param data:
+        :param encoding:
+        :param lenient: skip unknown keywords and invalid lines (instead of CueError)
+        :param hint: encoding to try before detection (see as_unicode())
+        :return: Cue() object
+    """
+
+    data_orig = data
+    data, encoding = as_unicode(data, encoding, hint=hint)
+
+    cue = CueParser(lenient).parse(data).close()
+    cue.data = data_orig
+    cue.encoding = encoding
+
+    return cue
+#
+
+
 def cue_maker(**argv):
     """ make .cue
 
@@ -778,19 +1126,433 @@ def cue_maker(**argv):
 #
 
 
-if __name__ == "__main__":
-    import sys
-
-    for cue_name in sys.argv[1:]:
-        with open(cue_name, "rb") as f:
-            f_cue = cue_parse(f.read(), encoding="utf-8")
-            print("%r %r" % (cue_name, f_cue.hex_sign()))
-            # print("%r %r" % (cue_name, cue.hex_sign(ignore_files=True)))
-            # print("%r %r" % (cue_name, cue.hex_sign(ignore_files=True, ignore_head=True)))
-            # print("%r %r" % (cue_name, cue.hex_sign(ignore_files=True, ignore_head=True, ignore_tracks=True)))
-            for f_track in f_cue:
-                print("TRK(%r)" % f_track)
+def cue_find(paths):
+    """ find .cue files (folders are searched recursively, sorted)
+
+        :param paths: files and folders
+        :return: generator of file names
+    """
+
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        #
+
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(".cue"):
+                    yield os.path.join(root, name)
+                #
+            #
+        #
+    #
+#
+
+
+def cue_load(name, encoding="cp1251", lenient=False, memo=ENCODING_MEMO):
+    """ load .cue from file, detected (by chardet) encoding is used as hint for next .cue of folder
+
+        :param name: file name
+        :param encoding: default encoding
+        :param lenient: lenient parser mode
+        :param memo: folder -> encoding (None - don't use)
+        :return: Cue() object
+    """
+
+    folder = os.path.dirname(os.path.abspath(name))
+    hint = memo.get(folder) if memo is not None else None
+
+    with open(name, "rb") as f:
+        cue = cue_parse(f.read(), encoding=encoding, lenient=lenient, hint=hint)
+    #
+
+    if memo is not None and cue.encoding not in ('ascii', hint) and not cue.encoding.startswith('utf'):
+        if len(memo) >= 4096:
+            memo.clear()
+        #
+        memo[folder] = cue.encoding
+    #
+
+    return cue
+#
+
+
+def cue_audit(name, encoding="cp1251", lenient=False, tracks=False):
+    """ parse, sign and check .cue (bulk worker, errors are returned)
+
+        :param name: file name
+        :param encoding: default encoding
+        :param lenient: lenient parser mode
+        :param tracks: return tracks (repr)
+        :return: dict: path, encoding, sign, tracks, errors, warnings
+    """
+
+    result = {"path": name, "encoding": "", "sign": "", "tracks": [] if tracks else 0, "errors": [], "warnings": []}
+
+    try:
+        cue = cue_load(name, encoding=encoding, lenient=lenient)
+        result["encoding"] = cue.encoding
+        result["sign"] = cue.hex_sign()
+        result["tracks"] = [repr(trk) for trk in cue] if tracks else len(cue)
+        result["errors"], result["warnings"] = cue.check()
+    except Exception, e:
+        # any error of one .cue mustn't stop bulk run
+        result["errors"].append("parse: %s" % e)
+    #
+
+    return result
+#
+
+
+def cue_text(result):
+    """ return result of cue_audit() for json/csv output: byte strings (paths) are decoded to unicode
+
+        :param result: dict
+        :return: dict
+    """
+
+    def text(value):
+        """"""
+
+        if isinstance(value, str):
+            return value.decode(sys.getfilesystemencoding() or "utf-8", "replace")
+        #
+
+        return value
+    #
+
+    return dict((key, [text(_) for _ in value] if isinstance(value, list) else text(value))
+                for key, value in result.iteritems())
+#
+
+
+def cue_signs(name, encoding="cp1251", lenient=False):
+    """ parse .cue and return signatures of all variants & TOC (signature index worker, errors are returned)
+
+        :param name: file name
+        :param encoding: default encoding
+        :param lenient: lenient parser mode
+        :return: (name, encoding, signs, toc, error)
+    """
+
+    try:
+        cue = cue_load(name, encoding=encoding, lenient=lenient)
+        return name, cue.encoding, cue.hex_signs(), cue.toc(), None
+    except Exception, e:
+        # any error of one .cue mustn't stop index update
+        return name, "", [], None, "%s" % e
+    #
+#
+
+
+def toc_distance(toc1, toc2):
+    """ return max difference of offsets (frames) of TOCs (None - different total tracks)
+
+        :param toc1:
+        :param toc2:
+    """
+
+    if len(toc1) != len(toc2):
+        return None
+    #
+
+    return max(abs(a - b) for a, b in itertools.izip(toc1, toc2))
+#
+
+
+class CueSignDb(object):
+    """ sqlite index of .cue signatures (all variants): signature -> .cue, and of TOCs (by total tracks & span),
+        updated incrementally (by mtime & size)
+    """
+
+    def __init__(self, name):
+        """
+            :param name: sqlite file
+        """
+
+        self.name = name
+        self.db = sqlite3.connect(name)
+        self.db.text_factory = str
+
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS cues (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, "
+                            "encoding TEXT, error TEXT)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS signs (sign TEXT, variant INTEGER, path TEXT, "
+                            "PRIMARY KEY (path, variant))")
+            self.db.execute("CREATE INDEX IF NOT EXISTS signs_sign ON signs (sign)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS tocs (path TEXT PRIMARY KEY, tracks INTEGER, span INTEGER, "
+                            "offsets TEXT)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS tocs_span ON tocs (tracks, span)")
+        #
+    #
+
+    def update(self, paths, encoding="cp1251", lenient=False, pool=None):
+        """ add new/changed .cue, remove deleted .cue (under searched folders)
+
+            :param paths: .cue files and folders (searched recursively)
+            :param encoding: default encoding
+            :param lenient: lenient parser mode
+            :param pool: process pool (None - in-place)
+            :return: dict: "total", "updated", "removed", "errors"
+        """
+
+        # .cue without TOC record (indexed before TOCs) is updated too
+        sql = "SELECT cues.path, size, mtime FROM cues JOIN tocs ON cues.path = tocs.path"
+        known = dict((row[0], row[1:]) for row in self.db.execute(sql))
+        seen = set()
+        changed = []
+
+        for name in cue_find(paths):
+            name = os.path.abspath(name)
+            seen.add(name)
+            try:
+                st = os.stat(name)
+            except OSError:
+                continue
+            #
+            if known.get(name) != (st.st_size, st.st_mtime):
+                changed.append((name, st))
+            #
+        #
+
+        stats = {"total": len(seen), "updated": 0, "removed": 0, "errors": 0}
+        folders = [os.path.join(os.path.abspath(path), "") for path in paths if os.path.isdir(path)]
+        removed = [(name,) for name in known if name not in seen and
+                   (any(name.startswith(folder) for folder in folders) or not os.path.exists(name))]
+
+        worker = functools.partial(cue_signs, encoding=encoding, lenient=lenient)
+        results = (pool.imap if pool else itertools.imap)(worker, [name for name, _ in changed])
+
+        with self.db:
+            self.db.executemany("DELETE FROM cues WHERE path = ?", removed)
+            self.db.executemany("DELETE FROM signs WHERE path = ?", removed)
+            self.db.executemany("DELETE FROM tocs WHERE path = ?", removed)
+            stats["removed"] = len(removed)
+
+            for (name, st), (_, cue_encoding, signs, toc, error) in itertools.izip(changed, results):
+                self.db.execute("INSERT OR REPLACE INTO cues VALUES (?, ?, ?, ?, ?)",
+                                (name, st.st_size, st.st_mtime, cue_encoding, error))
+                self.db.execute("DELETE FROM signs WHERE path = ?", (name,))
+                self.db.executemany("INSERT INTO signs VALUES (?, ?, ?)",
+                                    ((sign, variant, name) for variant, sign in signs))
+                self.db.execute("INSERT OR REPLACE INTO tocs VALUES (?, ?, ?, ?)",
+                                (name, len(toc), toc[-1], ",".join(map(str, toc))) if toc else
+                                (name, None, None, None))
+                stats["updated"] += 1
+                stats["errors"] += bool(error)
+            #
+        #
+
+        return stats
+    #
+
+    def lookup(self, sign, variant=None):
+        """ find .cue by signature
+
+            :param sign: hex-signature
+            :param variant: signature variant (None - any)
+            :return: list of (path, variant)
+        """
+
+        sql = "SELECT path, variant FROM signs WHERE sign = ?"
+        params = [sign.upper()]
+        if variant is not None:
+            sql += " AND variant = ?"
+            params.append(variant)
+        #
+
+        return self.db.execute(sql + " ORDER BY path, variant", params).fetchall()
+    #
+
+    def match(self, cue):
+        """ find .cue with the same signatures as cue (by variants)
+
+            :param cue: Cue()
+            :return: list of (path, variant)
+        """
+
+        found = []
+        for variant, sign in cue.hex_signs():
+            found.extend(self.lookup(sign, variant))
+        #
+
+        return sorted(found)
+    #
+
+    def similar(self, toc, tolerance=5):
+        """ find .cue with similar TOC: the same total tracks & all offsets within tolerance
+            (candidates are selected by total tracks & span of TOC)
+
+            :param toc: TOC (see Cue.toc()) or Cue()
+            :param tolerance: max difference of offsets (frames)
+            :return: list of (path, distance), sorted by distance
+        """
+
+        if isinstance(toc, Cue):
+            toc = toc.toc()
+        #
+
+        if not toc:
+            return []
+        #
+
+        found = []
+        sql = "SELECT path, offsets FROM tocs WHERE tracks = ? AND span BETWEEN ? AND ?"
+        for path, offsets in self.db.execute(sql, (len(toc), toc[-1] - tolerance, toc[-1] + tolerance)):
+            distance = toc_distance(toc, map(int, offsets.split(",")))
+            if distance <= tolerance:
+                found.append((path, distance))
             #
         #
+
+        return sorted(found, key=lambda x: (x[1], x[0]))
+    #
+
+    def __len__(self):
+        """"""
+
+        return self.db.execute("SELECT COUNT(*) FROM cues").fetchone()[0]
     #
 #
+
+
+def run_index(args):
+    """ update signature index by paths or lookup paths (.cue or hex-signatures) in index,
+        or find .cue with similar TOC
+
+        :param args: parsed arguments
+        :return: exit code
+    """
+
+    db = CueSignDb(args.db)
+    tt = time.time()
+
+    if args.similar:
+        found = 0
+        for path in args.path:
+            for name, distance in db.similar(cue_load(path, encoding=args.encoding, lenient=args.lenient),
+                                             tolerance=args.tolerance):
+                print("%s {%s} {%d}" % (path, name, distance))
+                found += 1
+            #
+        #
+        sys.stderr.write("found{%d} time{%.3f}\n" % (found, time.time() - tt))
+        return 0 if found else 3
+    #
+
+    if args.lookup:
+        found = 0
+        for path in args.path:
+            if os.path.isfile(path):
+                matches = db.match(cue_load(path, encoding=args.encoding, lenient=args.lenient))
+            else:
+                matches = db.lookup(path)
+            #
+            for name, variant in matches:
+                print("%s {%s} {%d}" % (path, name, variant))
+            #
+            found += len(matches)
+        #
+        sys.stderr.write("found{%d} time{%.3f}\n" % (found, time.time() - tt))
+        return 0 if found else 3
+    #
+
+    pool = multiprocessing.Pool(args.jobs or None)
+    try:
+        stats = db.update(args.path, encoding=args.encoding, lenient=args.lenient, pool=pool)
+    finally:
+        pool.terminate()
+    #
+
+    tt = time.time() - tt
+    sys.stderr.write("files{%d} updated{%d} removed{%d} errors{%d} time{%.3f} indexed{%d}\n" %
+                     (stats["total"], stats["updated"], stats["removed"], stats["errors"], tt, len(db)))
+    return 0
+#
+
+
+def main():
+    """ sign & check .cue files (folders are searched recursively) by process pool
+
+        :return: exit code
+    """
+
+    import csv
+    import json
+    import argparse
+
+    parser = argparse.ArgumentParser(description="cue tools library: sign & check .cue")
+    parser.add_argument('path', help='.cue file or folder', nargs='+')
+    parser.add_argument('-j', '--jobs', help='total parallel jobs (0 - cpu count)', type=int, default=0,
+                        action="store")
+    parser.add_argument('-f', '--format', help='output format', choices=("text", "json", "csv"), default="text")
+    parser.add_argument('-e', '--encoding', help='default encoding (if not detected)', type=str, default="cp1251",
+                        action="store")
+    parser.add_argument('--lenient', help='skip unknown keywords', default=False, action='store_true')
+    parser.add_argument('--db', help='signature index (sqlite): update by paths', type=str, action="store")
+    parser.add_argument('--lookup', help='find paths (.cue or hex-signature) in signature index', default=False,
+                        action='store_true')
+    parser.add_argument('--similar', help='find .cue with similar TOC in signature index', default=False,
+                        action='store_true')
+    parser.add_argument('--tolerance', help='max difference of track offsets for --similar (frames)', type=int,
+                        default=5, action="store")
+    parser.add_argument('-v', '--verbose', help='print tracks (text format)', default=False, action='store_true')
+    args = parser.parse_args()
+
+    if args.db:
+        return run_index(args)
+    elif args.lookup or args.similar:
+        print("error: '--%s' needs '--db'" % ("lookup" if args.lookup else "similar"))
+        return 1
+    #
+
+    fields = ("path", "encoding", "sign", "tracks", "errors", "warnings")
+    if args.format == "csv":
+        writer = csv.writer(sys.stdout)
+        writer.writerow(fields)
+    #
+
+    worker = functools.partial(cue_audit, encoding=args.encoding, lenient=args.lenient,
+                               tracks=args.verbose and args.format == "text")
+    pool = multiprocessing.Pool(args.jobs or None)
+    total, failed = 0, 0
+    tt = time.time()
+
+    try:
+        for result in pool.imap(worker, cue_find(args.path), chunksize=16):
+            total += 1
+            failed += bool(result["errors"])
+
+            if args.format == "json":
+                print(json.dumps(cue_text(result), ensure_ascii=False).encode("utf-8"))
+            elif args.format == "csv":
+                row = cue_text(result)
+                writer.writerow([(u"; ".join(row[_]) if isinstance(row[_], list) else
+                                  unicode(row[_])).encode("utf-8") for _ in fields])
+            else:
+                print("%r %r" % (result["path"], result["sign"]))
+                for _ in result["errors"]:
+                    print("ERROR(%s)" % _)
+                #
+                if args.verbose:
+                    for _ in result["tracks"]:
+                        print("TRK(%s)" % _)
+                    #
+                #
+            #
+        #
+    finally:
+        pool.terminate()
+    #
+
+    tt = time.time() - tt
+    sys.stderr.write("files{%d} errors{%d} time{%.3f} cue/s{%.1f}\n" % (total, failed, tt, total / tt if tt else 0))
+
+    return 2 if failed else 0
+#
+
+if __name__ == "__main__":
+    sys.exit(main())
+#
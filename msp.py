@@ -8,10 +8,13 @@ import sys
 import time
 import pprint
 import argparse
+import Queue
+import multiprocessing
 import json as jsonlib
 from zipfile import ZipFile, ZipInfo, ZIP_STORED
 
-from msplib import Fs, FsFile, scan_print, mk_fs, get_bytes
+from msplib import Fs, FsFile, scan_print, mk_fs, get_bytes, fs_diff, fs_verify, fs_dups, parse_query, QUERY_COLUMNS
+from msplib import set_extractors
 
 
 ZIP_FILE_RW = 0644 << 16L  # permissions -rw-r--r--
@@ -65,18 +68,35 @@ def dump(fs):
 #
 
 
-def mk_zip(name, fs, encoding="utf-8"):
+def iter_names(fs):
+    """ iterate (name, FsFile()) sorted by name (records are loaded one-by-one)
+
+        :param fs:
+    """
+
+    for k, v in fs.iter_files():
+        yield os.path.join(get_path(v.path), v.name), v
+    #
+#
+
+
+def mk_zip(name, fs, encoding="utf-8", stream=True):
     """make .zip from fs
 
         :param name:
         :param fs:
         :param encoding:
+        :param stream: write records one-by-one (False - collect all records before write)
     """
 
-    data = dump(fs)
-    names = sorted(data.keys())
+    if stream:
+        records = iter_names(fs)
+    else:
+        data = dump(fs)
+        records = ((name, data[name]) for name in sorted(data.keys()))
+    #
 
-    with ZipFile(name, "w", ZIP_STORED) as zipf:
+    with ZipFile(name, "w", ZIP_STORED, allowZip64=True) as zipf:
         # # save fs object as binary data
         # fs_name = (fs.root_u.encode(encoding) + ".fs").replace('/', '_').replace('\\', '_')
         # fs_time = time.localtime(time.time())
@@ -85,9 +105,7 @@ def mk_zip(name, fs, encoding="utf-8"):
         # zi.external_attr = ZIP_FILE_RW
         # zipf.writestr(zi, fs_data)
 
-        for name in names:
-            f = data[name]
-
+        for name, f in records:
             if not isinstance(f, FsFile):
                 # oops! unknown object
                 continue
@@ -112,6 +130,10 @@ def mk_zip(name, fs, encoding="utf-8"):
                     meta['md5'] = f.md5
                 #
 
+                if getattr(f, "hash", None):
+                    meta['hash'] = f.hash
+                #
+
                 meta['file_size'] = f.stat.st_size
                 meta['file_time'] = f.stat.st_mtime
                 meta['file_date'] = time.ctime(f.stat.st_mtime)
@@ -165,10 +187,8 @@ def mk_txt(name, fs, encoding="utf-8"):
         :return:
     """
 
-    data = dump(fs)
-
     with open(name, "wb") as txt:
-        for f_name in sorted(data.keys()):
+        for f_name, _ in iter_names(fs):
             if f_name:
                 txt.write(f_name.encode(encoding))
                 txt.write("\n")
@@ -178,6 +198,305 @@ def mk_txt(name, fs, encoding="utf-8"):
 #
 
 
+def process(path, args):
+    """ scan (or load) path and make .fs/.zip/.txt
+
+        :param path: folder or .fs file
+        :param args: parsed arguments
+        :return: (path, total files, time, error)
+    """
+
+    tt = time.time()
+
+    if args.verbose:
+        callback = scan_print
+    else:
+        callback = None
+    #
+
+    if args.out:
+        name = args.out
+    else:
+        name = os.path.basename(os.path.abspath(path))
+    #
+
+    if os.path.isdir(path):
+        print("scan {%s}" % path)
+        snapshot = name + ".fs" if args.incremental else None
+        fs = mk_fs(path, basename=name, callback=callback, workers=args.workers, pool=args.pool,
+                   snapshot=snapshot, deep=args.deep, content_hash=args.hash)
+    else:
+        print("load {%s}" % path)
+        fs = Fs()
+        fs.load(path)
+        print("root{%r} index{%r} files{%r}" % (fs.root, len(fs.index), len(fs.files)))
+    #
+
+    if not isinstance(fs, Fs):
+        print("fatal: unknown object {%r}" % fs)
+        return path, 0, time.time() - tt, "unknown object"
+    #
+
+    # empty fs?
+    if len(fs) < 2:
+        return path, len(fs), time.time() - tt, None
+    #
+
+    if args.sign:
+        sign = fs.hex_sign()
+        name = "fs" + sign.lower()
+    #
+
+    if args.make_fs:
+        fn = name + ".fs"
+        tty("\n")
+        tty("make {%s} {%r}" % (fn, len(fs)))
+        fs.dump(fn, pack=True, fmt=args.format, codec=args.codec, level=args.level)
+    #
+
+    if args.make_zip:
+        fn = name + ".zip"
+        tty("\n")
+        tty("make {%s}" % fn)
+        mk_zip(fn, fs)
+    #
+
+    if args.make_text:
+        fn = name + ".txt"
+        tty("\n")
+        tty("make {%s}" % fn)
+        mk_txt(fn, fs)
+    #
+
+    tty('\n')
+    return path, len(fs), time.time() - tt, None
+#
+
+
+def process_job(job):
+    """ process() for worker (errors are returned)
+
+        :param job: (path, args)
+    """
+
+    path, args = job
+
+    try:
+        return process(path, args)
+    except Exception as e:
+        return path, 0, 0.0, repr(e)
+    #
+#
+
+
+def run_parallel(args):
+    """ process paths in process pool (with limit of concurrent jobs per device)
+
+        :param args: parsed arguments
+        :return: exit code
+    """
+
+    if args.workers and args.pool == "process":
+        # jobs run in daemonic processes (which can't have children): scan workers are threads
+        tty("warning: '--pool process' isn't supported with '--jobs', thread pool is used\n")
+        args.pool = "thread"
+    #
+
+    per_device = args.per_device or args.jobs
+    pending = [(path, os.stat(path).st_dev) for path in args.path]
+    running = {}  # device -> total running jobs
+    results = Queue.Queue()
+    done = []
+
+    tt = time.time()
+    pool = multiprocessing.Pool(args.jobs)
+
+    try:
+        active = 0
+        while pending or active:
+            # schedule jobs (free workers and devices)
+            for job in list(pending):
+                if active >= args.jobs:
+                    break
+                #
+                path, dev = job
+                if running.get(dev, 0) >= per_device:
+                    continue
+                #
+                pending.remove(job)
+                running[dev] = running.get(dev, 0) + 1
+                active += 1
+                pool.apply_async(process_job, ((path, args),), callback=lambda r, d=dev: results.put((r, d)))
+            #
+
+            (path, total, t_job, error), dev = results.get()
+            running[dev] -= 1
+            active -= 1
+            done.append((path, total, t_job, error))
+
+            tty("[%d/%d] {%s} files{%r} time{%.3f}%s\n" % (len(done), len(args.path), path, total, t_job,
+                                                          " error{%s}" % error if error else ""))
+        #
+    finally:
+        pool.close()
+        pool.join()
+    #
+
+    # summary
+    tty("\n")
+    for path, total, t_job, error in sorted(done, key=lambda x: -x[2]):
+        tty("%9.3f %8d {%s}%s\n" % (t_job, total, path, " error{%s}" % error if error else ""))
+    #
+    tty("total jobs{%d} files{%d} time{%.3f} wall{%.3f}\n" %
+        (len(done), sum(_[1] for _ in done), sum(_[2] for _ in done), time.time() - tt))
+
+    return 2 if any(_[3] for _ in done) else 0
+#
+
+
+def load_fs(path, args):
+    """ load .fs (or scan folder)
+
+        :param path: folder or .fs file
+        :param args: parsed arguments
+    """
+
+    if os.path.isdir(path):
+        return mk_fs(path, workers=args.workers, pool=args.pool, content_hash=args.hash)
+    #
+
+    return Fs().load(path)
+#
+
+
+def run_diff(args):
+    """ print difference between two .fs (or .fs and folder), for '--verify' by merkle hashes of folders
+
+        :param args: parsed arguments
+        :return: exit code
+    """
+
+    if len(args.path) != 2:
+        print("error: '--%s' needs two paths (old & new)" % ("verify" if args.verify else "diff"))
+        return 1
+    #
+
+    marks = {"added": "+", "removed": "-", "modified": "M", "moved": "R"}
+    old, new = [load_fs(path, args) for path in args.path]
+    total = 0
+
+    if args.verify:
+        changes = fs_verify(old, new)
+    else:
+        changes = fs_diff(old, new, folders=args.verbose > 1)
+    #
+
+    for op, old_name, new_name in changes:
+        total += 1
+        if op == "moved":
+            print("%s {%s} -> {%s}" % (marks[op], old_name, new_name))
+        else:
+            print("%s {%s}" % (marks[op], old_name or new_name))
+        #
+    #
+
+    return 3 if total else 0
+#
+
+
+def run_dups(args):
+    """ print duplicate files and albums over paths (.fs or folders)
+
+        :param args: parsed arguments
+        :return: exit code
+    """
+
+    fss = [load_fs(path, args) for path in args.path]
+    dups = fs_dups(fss)
+
+    for title, groups in (("file", dups["files"]), ("album", dups["albums"])):
+        for sign, group in groups:
+            print("%s {%s}" % (title, sign))
+            for row in group:
+                print("  %8d {%s} {%s}" % (row[2], args.path[row[0]], row[1]))
+            #
+        #
+    #
+
+    print("files{%d} reclaimable{%d}" % (len(dups["files"]), dups["reclaimable"]))
+    print("albums{%d} reclaimable{%d}" % (len(dups["albums"]), dups["reclaimable_albums"]))
+    return 0
+#
+
+
+def run_query(args):
+    """ print files matching query over paths (.fs or folders)
+
+        :param args: parsed arguments
+        :return: exit code
+    """
+
+    try:
+        conds = [parse_query(expr) for expr in args.query]
+    except ValueError, e:
+        print("error: %s" % e)
+        return 1
+    #
+
+    total = 0
+    for path in args.path:
+        fs = load_fs(path, args)
+        tt = time.time()
+        names = fs.query(conds)
+        tt = time.time() - tt
+        for name in names:
+            print("{%s} {%s}" % (path, name))
+        #
+        if args.verbose:
+            print("path{%s} found{%d} time{%.3f}" % (path, len(names), tt))
+        #
+        total += len(names)
+    #
+
+    return 0 if total else 3
+#
+
+
+def run_watch(args):
+    """ watch folder and keep .fs up to date (until interrupted)
+
+        :param args: parsed arguments
+        :return: exit code
+    """
+
+    if len(args.path) != 1 or not os.path.isdir(args.path[0]):
+        print("error: '--watch' needs one folder")
+        return 1
+    #
+
+    path = args.path[0]
+    name = (args.out or os.path.basename(os.path.abspath(path))) + ".fs"
+
+    fs = Fs(root=path)
+    fs.content_hash = args.hash
+    if os.path.exists(name):
+        fs.load(name, ignore=True)
+        fs.chg_root(path)
+    #
+
+    print("watch {%s} snapshot {%s}" % (path, name))
+    try:
+        fs.watch(callback=scan_print if args.verbose else None, workers=args.workers, pool=args.pool,
+                 delay=args.delay, checkpoint=args.checkpoint, snapshot=name, fmt=args.format, codec=args.codec,
+                 level=args.level)
+    except KeyboardInterrupt:
+        pass
+    #
+
+    return 0
+#
+
+
 def main():
     """
         :return:
@@ -190,9 +509,62 @@ def main():
     parser.add_argument('-t', '--make_text', help='make .txt', default=False, action='store_true')
     parser.add_argument('-s', '--sign', help='make signature as prefix', default=False, action='store_true')
     parser.add_argument('-d', '--dir', help='make one .fs for every dir', default=False, action='store_true')
+    parser.add_argument('-w', '--workers', help='total scan workers', type=int, default=0, action="store")
+    parser.add_argument('--pool', help='scan workers pool mode', choices=("thread", "process"), default="thread")
+    parser.add_argument('-i', '--incremental', help='rescan over existing .fs (skip unchanged folders)',
+                        default=False, action='store_true')
+    parser.add_argument('--deep', help='force deep verification for incremental rescan', default=False,
+                        action='store_true')
+    parser.add_argument('--hash', help='content hash for audio (hashlib/xxhash name)', nargs='?', const="auto",
+                        default=None, action="store")
+    parser.add_argument('--extract-timeout', help='max time of meta-data extraction per file (seconds)', type=float,
+                        default=None, action="store")
+    parser.add_argument('--isolate', help='extract meta-data in separate process (for damaged files)',
+                        default=False, action='store_true')
+    parser.add_argument('--format', help='.fs format', choices=("pickle", "index", "sqlite"),
+                        default="pickle")
+    parser.add_argument('-c', '--codec', help='.fs codec', choices=("none", "zlib", "bz2", "lzma"), default=None)
+    parser.add_argument('-l', '--level', help='.fs compression level', type=int, default=None, action="store")
+    parser.add_argument('-j', '--jobs', help='total parallel jobs (paths)', type=int, default=1, action="store")
+    parser.add_argument('--per-device', help='max parallel jobs per device', type=int, default=0, action="store")
+    parser.add_argument('--diff', help='compare two paths (.fs or folder): old & new', default=False,
+                        action='store_true')
+    parser.add_argument('--verify', help='compare two paths (.fs or folder) by folder hashes: old & new',
+                        default=False, action='store_true')
+    parser.add_argument('--dups', help='find duplicate files/albums over paths (.fs or folder)', default=False,
+                        action='store_true')
+    parser.add_argument('-q', '--query', help='find files over paths (.fs or folder) by condition: '
+                        'tag=value, column=value, column<value, ... (columns: %s)' % ", ".join(QUERY_COLUMNS),
+                        action="append", default=[])
+    parser.add_argument('--watch', help='watch folder by inotify and keep .fs up to date', default=False,
+                        action='store_true')
+    parser.add_argument('--delay', help='watch: delay of rescan after changes (seconds)', type=float, default=1.0,
+                        action="store")
+    parser.add_argument('--checkpoint', help='watch: .fs save interval (seconds)', type=float, default=300.0,
+                        action="store")
     parser.add_argument('-v', '--verbose', help='increase output verbosity', action="count", default=0)
     args = parser.parse_args()
 
+    if args.extract_timeout or args.isolate:
+        set_extractors(timeout=args.extract_timeout, isolation="process" if args.isolate else None)
+    #
+
+    if args.diff or args.verify:
+        return run_diff(args)
+    #
+
+    if args.dups:
+        return run_dups(args)
+    #
+
+    if args.query:
+        return run_query(args)
+    #
+
+    if args.watch:
+        return run_watch(args)
+    #
+
     if args.dir:
         args.make_fs = True
         new_dirs = []
@@ -215,70 +587,18 @@ def main():
         return 1
     #
 
-    if args.verbose:
-        callback = scan_print
-    else:
-        callback = None
+    if args.jobs > 1 and len(args.path) > 1:
+        return run_parallel(args)
     #
 
     for path in args.path:
-
-        if args.out:
-            name = args.out
-        else:
-            name = os.path.basename(os.path.abspath(path))
-        #
-
-        if os.path.isdir(path):
-            print("scan {%s}" % path)
-            fs = mk_fs(path, basename=name, callback=callback)
-        else:
-            print("load {%s}" % path)
-            fs = Fs()
-            fs.load(path)
-            print("root{%r} index{%r} files{%r}" % (fs.root, len(fs.index), len(fs.files)))
-        #
-
-        if not isinstance(fs, Fs):
-            print("fatal: unknown object {%r}" % fs)
+        path, total, tt, error = process(path, args)
+        if error:
             return 2
         #
-
-        # empty fs?
-        if len(fs) < 2:
-            continue
-        #
-
-        if args.sign:
-            sign = fs.hex_sign()
-            name = "fs" + sign.lower()
-        #
-
-        if args.make_fs:
-            fn = name + ".fs"
-            tty("\n")
-            tty("make {%s} {%r}" % (fn, len(fs)))
-            fs.dump(fn, pack=True)
-        #
-
-        if args.make_zip:
-            fn = name + ".zip"
-            tty("\n")
-            tty("make {%s}" % fn)
-            mk_zip(fn, fs)
-        #
-
-        if args.make_text:
-            fn = name + ".txt"
-            tty("\n")
-            tty("make {%s}" % fn)
-            mk_txt(fn, fs)
-        #
-
-        tty('\n')
     #
 #
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
 #
@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" media scan program (benchmarks) """
+
+import os
+import sys
+import time
+import shutil
+import resource
+import tempfile
+import argparse
+import subprocess
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+#
+
+import msp
+import msplib
+
+
+def mk_tree(path, dirs=100, files=20, suffix=".bin"):
+    """ make synthetic folder tree
+
+        :param path:
+        :param dirs: total folders
+        :param files: total files per folder
+        :param suffix: files suffix
+        :return: total files
+    """
+
+    for d in xrange(dirs):
+        d_name = os.path.join(path, "artist%03d" % (d % 10), "album%04d" % d)
+        os.makedirs(d_name)
+        for n in xrange(files):
+            with open(os.path.join(d_name, "%02d%s" % (n, suffix)), "wb") as f:
+                f.write("x" * n)
+            #
+        #
+    #
+
+    return dirs * files
+#
+
+
+class StatCounter(object):
+    """ count stat() calls (os.stat/os.lstat/DirEntry.stat) """
+
+    def __init__(self):
+        """"""
+
+        self.total = 0
+        self.saved = None
+    #
+
+    def wrap(self, fn):
+        """ wrap function with counter
+
+            :param fn:
+        """
+
+        def _fn(*args, **kwargs):
+            self.total += 1
+            return fn(*args, **kwargs)
+        #
+
+        return _fn
+    #
+
+    def wrap_scandir(self, fn):
+        """ wrap scandir() (count DirEntry.stat() calls)
+
+            :param fn:
+        """
+
+        counter = self
+
+        class Entry(object):
+            """ counted DirEntry """
+
+            def __init__(self, entry):
+                """"""
+
+                self.entry = entry
+                self.name = entry.name
+            #
+
+            def stat(self, **kwargs):
+                """"""
+
+                counter.total += 1
+                return self.entry.stat(**kwargs)
+            #
+
+            def is_dir(self, **kwargs):
+                """"""
+
+                return self.entry.is_dir(**kwargs)
+            #
+        #
+
+        def _fn(path):
+            return [Entry(entry) for entry in fn(path)]
+        #
+
+        return _fn
+    #
+
+    def __enter__(self):
+        """"""
+
+        self.saved = (os.stat, os.lstat, msplib.scandir)
+        os.stat, os.lstat = self.wrap(os.stat), self.wrap(os.lstat)
+        if msplib.scandir:
+            msplib.scandir = self.wrap_scandir(msplib.scandir)
+        #
+        return self
+    #
+
+    def __exit__(self, *args):
+        """"""
+
+        os.stat, os.lstat, msplib.scandir = self.saved
+    #
+#
+
+
+def legacy_walk(root):
+    """ os.path.walk() + per-entry os.stat() walker (as Fs.scan before scandir)
+
+        :param root:
+    """
+
+    def collector(arg, path, names):
+        """"""
+
+        if os.path.isdir(path):
+            data = {}
+            for fname in os.listdir(path):
+                data[fname] = os.stat(os.path.join(path, fname))
+            #
+        #
+
+        for name in names:
+            _name = os.path.join(path, name)
+            if not os.path.isfile(_name):
+                continue
+            #
+            os.stat(_name)
+        #
+    #
+
+    os.path.walk(root, collector, None)
+#
+
+
+def bench_stat(args):
+    """ compare stat() calls for legacy walker and Fs.scan()
+
+        :param args:
+    """
+
+    path = tempfile.mkdtemp(prefix="msp_bench")
+    try:
+        total = mk_tree(path, dirs=args.dirs, files=args.files)
+        print("tree {%s} dirs{%r} files{%r} scandir{%r}" % (path, args.dirs, total, bool(msplib.scandir)))
+
+        for name, fn in (("legacy", legacy_walk), ("scan", lambda p: msplib.Fs(p).scan())):
+            with StatCounter() as counter:
+                tt = time.time()
+                fn(path)
+                tt = time.time() - tt
+            #
+            print("%-8s stat{%8d} per-file{%5.2f} time{%.3f}" % (name, counter.total, float(counter.total) / total, tt))
+        #
+    finally:
+        shutil.rmtree(path)
+    #
+#
+
+
+def mk_synthetic_fs(total=10000):
+    """ make synthetic Fs() (without file system)
+
+        :param total: total files
+        :return: Fs()
+    """
+
+    fs = msplib.Fs("/synthetic")
+    now = time.time()
+
+    for n in xrange(total):
+        path = u"/artist%03d/album%04d" % (n % 100, n // 20)
+        name = u"%02d - track.flac" % (n % 20) if n % 10 else u"album.cue"
+        st = os.stat_result((0100644, n, 1, 1, 0, 0, 30000000 + n, now, now - n, now - n))
+        f = msplib.FsFile(path, name, st)
+        if n % 10:
+            f.tags = {"artist": [u"artist%03d" % (n % 100)], "album": [u"album%04d" % (n // 20)],
+                      "title": [u"track %d" % n], "date": [u"%d" % (1970 + n % 50)]}
+            f.meta = {"bits_per_sample": 16 + 8 * (n % 2), "channels": 2, "sample_rate": 44100,
+                      "total_samples": 10000000 + n, "length": 240.0 + n % 100, "md5_signature": n}
+            f.md5 = msplib.get_hex(n, size=32)
+        else:
+            f.data = "REM DATE 2000\nPERFORMER \"artist\"\n" * 40
+            f.md5 = msplib.hashlib.md5(f.data).hexdigest()
+        #
+        fs.files[os.path.join(path, name)] = f
+    #
+
+    return fs
+#
+
+
+def bench_codec(args):
+    """ dump/load time and size per codec (and .fs format)
+
+        :param args:
+    """
+
+    fs = mk_synthetic_fs(args.total)
+    path = tempfile.mkdtemp(prefix="msp_bench")
+    print("synthetic fs files{%r}" % len(fs))
+
+    try:
+        for fmt in ("pickle", "index"):
+            for codec in sorted(msplib.CODECS):
+                if codec == "lzma" and not msplib.lzma:
+                    continue
+                #
+
+                name = os.path.join(path, "%s_%s.fs" % (fmt, codec))
+
+                tt = time.time()
+                fs.dump(name, fmt=fmt, codec=codec)
+                t_dump = time.time() - tt
+
+                tt = time.time()
+                fs_load = msplib.Fs().load(name)
+                t_len = time.time() - tt
+                for key in fs_load.files:
+                    fs_load.files[key]
+                #
+                t_load = time.time() - tt
+
+                print("%-6s %-4s size{%10d} dump{%7.3f} load-len{%7.3f} load-all{%7.3f}" %
+                      (fmt, codec, os.path.getsize(name), t_dump, t_len, t_load))
+            #
+        #
+    finally:
+        shutil.rmtree(path)
+    #
+#
+
+
+class LegacyFsFile(object):
+    """ FsFile() before slots (full os.stat_result and __dict__) """
+
+    def __init__(self, path=None, name=None, stat=None):
+        """"""
+
+        self.path = path
+        self.name = name
+        self.stat = stat
+        self.time = time.time()
+        self.type = None
+        self.data = None
+        self.meta = None
+        self.tags = None
+        self.md5 = None
+    #
+#
+
+
+def deep_sizeof(obj, seen=None):
+    """ total size of object (with referenced objects)
+
+        :param obj:
+        :param seen: ids of counted objects
+    """
+
+    if seen is None:
+        seen = set()
+    #
+
+    if id(obj) in seen:
+        return 0
+    #
+
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.iteritems())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(v, seen) for v in obj)
+    elif not isinstance(obj, basestring):
+        if hasattr(obj, "__dict__"):
+            size += deep_sizeof(obj.__dict__, seen)
+        #
+        for name in getattr(type(obj), "__slots__", ()):
+            size += deep_sizeof(getattr(obj, name, None), seen)
+        #
+    #
+
+    return size
+#
+
+
+def bench_memory(args):
+    """ bytes per file (in memory and pickled) for legacy and compact FsFile()
+
+        :param args:
+    """
+
+    now = time.time()
+    total = args.total
+    per_dir = 20
+
+    for name, cls in (("legacy", LegacyFsFile), ("compact", msplib.FsFile)):
+        files = {}
+        for n in xrange(total):
+            path = u"/artist%03d/album%04d" % (n % 100, n // per_dir)
+            st = os.stat_result((0100644, n, 1, 1, 0, 0, 30000000 + n, now, now - n, now - n))
+            f = cls(path, u"%02d - track.flac" % (n % per_dir), st)
+            f.md5 = msplib.get_hex(n, size=32)
+            files[path + u"/" + f.name] = f
+
+            # folder record (with listing)
+            if n % per_dir == 0:
+                d = cls(path, u"", st)
+                d.type = "DIR"
+                d.data = {}
+                files[path] = d
+            #
+            d.data[f.name] = st if cls is LegacyFsFile else msplib.FsStat.make(st)
+        #
+
+        size = deep_sizeof(files)
+        packed = len(pickle.dumps(files, protocol=-1))
+        print("%-8s memory{%8.1f} pickle{%8.1f} bytes per file" % (name, float(size) / total, float(packed) / total))
+    #
+#
+
+
+def bench_zip_run(args):
+    """ make .zip from .fs and print time & peak RSS (runs in separate process)
+
+        :param args:
+    """
+
+    fs = msplib.Fs().load(args.fs)
+    name = args.fs + ".zip"
+
+    tt = time.time()
+    msp.mk_zip(name, fs, stream=args.mode == "stream")
+    tt = time.time() - tt
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print("%-8s files{%r} time{%7.3f} files/s{%9.1f} peak-rss{%8d KiB} size{%d}" %
+          (args.mode, len(fs), tt, len(fs) / tt, rss, os.path.getsize(name)))
+#
+
+
+def bench_zip(args):
+    """ peak RSS & throughput of mk_zip() (collect-all vs streaming) for indexed snapshot
+
+        :param args:
+    """
+
+    path = tempfile.mkdtemp(prefix="msp_bench")
+
+    try:
+        name = os.path.join(path, "synthetic.fs")
+        mk_synthetic_fs(args.total).dump(name, fmt="index")
+
+        for mode in ("legacy", "stream"):
+            subprocess.check_call([sys.executable, __file__, "zip-run", "--fs", name, "--mode", mode])
+        #
+    finally:
+        shutil.rmtree(path)
+    #
+#
+
+
+def main():
+    """
+        :return:
+    """
+
+    parser = argparse.ArgumentParser(description="media scan program (benchmarks)")
+    parser.add_argument('bench', help='benchmark', choices=("stat", "codec", "memory", "zip", "zip-run"))
+    parser.add_argument('--dirs', help='total folders', type=int, default=100, action="store")
+    parser.add_argument('--files', help='total files per folder', type=int, default=20, action="store")
+    parser.add_argument('--total', help='total files for synthetic fs', type=int, default=10000, action="store")
+    parser.add_argument('--fs', help='.fs file (for zip-run)', type=str, action="store")
+    parser.add_argument('--mode', help='mk_zip mode (for zip-run)', choices=("legacy", "stream"), default="stream")
+    args = parser.parse_args()
+
+    if args.bench == "stat":
+        bench_stat(args)
+    elif args.bench == "codec":
+        bench_codec(args)
+    elif args.bench == "memory":
+        bench_memory(args)
+    elif args.bench == "zip":
+        bench_zip(args)
+    elif args.bench == "zip-run":
+        bench_zip_run(args)
+    #
+
+    return 0
+#
+
+if __name__ == "__main__":
+    sys.exit(main())
+#
@@ -4,13 +4,32 @@
 """ media scan program (library) """
 
 import os
+import stat
 import time
 import hashlib
 import string
 import mutagen
 import chardet
 import bz2
+import zlib
+import mmap
+import struct
+import bisect
 import binascii
+import sqlite3
+import collections
+import itertools
+import multiprocessing.pool
+import select
+import errno
+import ctypes
+import ctypes.util
+import re
+import json
+import signal
+import threading
+import subprocess
+import distutils.spawn
 from PIL import Image
 
 try:
@@ -19,421 +38,2941 @@ except ImportError:
     import pickle
 #
 
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+#
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+    #
+#
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+#
+
+FFPROBE = distutils.spawn.find_executable("ffprobe")
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+    #
+#
+
+
+class FsStat(collections.namedtuple("FsStat", "st_size st_mtime st_ctime st_mode st_ino")):
+    """ file stat (only used fields of os.stat_result) """
+
+    __slots__ = ()
+
+    @classmethod
+    def make(cls, st):
+        """ make from os.stat_result
+
+            :param st:
+        """
+
+        if st is None or isinstance(st, cls):
+            return st
+        #
+
+        return cls(st.st_size, st.st_mtime, st.st_ctime, st.st_mode, st.st_ino)
+    #
+#
+
 
 class FsFile(object):
     """ file from file system """
 
+    __slots__ = ("path", "name", "stat", "time", "type", "data", "meta", "tags", "md5", "hash")
+
     def __init__(self, path=None, name=None, stat=None):
         """"""
 
         self.path = path
         self.name = name
-        self.stat = stat
+        self.stat = FsStat.make(stat)
         self.time = time.time()
         self.type = None
         self.data = None
         self.meta = None
         self.tags = None
         self.md5 = None
+        self.hash = None
+    #
+
+    def __getstate__(self):
+        """ values of slots (file with changed/removed source of data is saved as "REF": md5 & size only) """
+
+        if isinstance(self.data, FsData) and self.data.loaded() is None:
+            return tuple("REF" if name == "type" else None if name == "data" else getattr(self, name)
+                         for name in self.__slots__)
+        #
+
+        return tuple(getattr(self, name) for name in self.__slots__)
+    #
+
+    def __setstate__(self, state):
+        """ load state (values of slots or __dict__ of old FsFile)
+
+            :param state:
+        """
+
+        if isinstance(state, dict):
+            state = tuple(state.get(name) for name in self.__slots__)
+        #
+
+        for name, value in itertools.izip_longest(self.__slots__, state):
+            setattr(self, name, value)
+        #
+
+        # old FsFile: os.stat_result -> FsStat
+        self.stat = FsStat.make(self.stat)
+        if self.type == "DIR" and self.data:
+            self.data = dict((name, FsStat.make(st)) for name, st in self.data.iteritems())
+        #
     #
 #
 
 
-def load_audio_meta(name):
-    """ load meta-data from audio file
+class DataCache(object):
+    """ LRU cache of files data (bounded by total size) """
 
-        :param name:
-    """
+    def __init__(self, limit=64 << 20):
+        """
+            :param limit: max total size of cached data
+        """
 
-    info_tags = ('bits_per_sample', 'channels', 'md5_signature', 'sample_rate', 'total_samples', 'length')
+        self.limit = limit
+        self.size = 0
+        self.data = collections.OrderedDict()
+    #
 
-    meta = {}
-    tags = {}
-    audio = mutagen.File(name, easy=True)
+    def get(self, key):
+        """ return cached data (None if not found)
 
-    # tags
-    for key in audio:
-        tags[key] = audio[key]
+            :param key:
+        """
+
+        data = self.data.pop(key, None)
+        if data is not None:
+            self.data[key] = data
+        #
+
+        return data
     #
 
-    # meta
-    for key in info_tags:
-        meta[key] = getattr(audio.info, key, None)
+    def put(self, key, data):
+        """ cache data (least recently used data is dropped)
+
+            :param key:
+            :param data:
+        """
+
+        old = self.data.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        #
+
+        if len(data) > self.limit:
+            return
+        #
+
+        self.data[key] = data
+        self.size += len(data)
+
+        while self.size > self.limit:
+            _, old = self.data.popitem(last=False)
+            self.size -= len(old)
+        #
     #
+#
 
-    return tags, meta
+
+# cache of "full" files data (see FsData)
+DATA_CACHE = DataCache()
+
+
+class FsData(object):
+    """ data of "full" file: size & md5 are kept, content is loaded on demand (from snapshot or from file) """
+
+    __slots__ = ("size", "md5", "source", "offset", "pinned")
+
+    def __init__(self, size, md5, source=None, offset=None, data=None):
+        """
+            :param size:
+            :param md5: md5 (as hex)
+            :param source: file name (absolute) or snapshot with blob() method
+            :param offset: offset of data in snapshot
+            :param data: content (cached)
+        """
+
+        self.size = size
+        self.md5 = md5
+        self.source = source
+        self.offset = offset
+        self.pinned = None
+
+        if data is not None:
+            if source is None:
+                self.pinned = data
+            else:
+                DATA_CACHE.put(self.key(), data)
+            #
+        #
+    #
+
+    def key(self):
+        """ cache key
+        """
+
+        if isinstance(self.source, basestring):
+            return self.source, self.md5
+        #
+
+        return id(self.source), self.offset, self.md5
+    #
+
+    def content(self):
+        """ return content
+        """
+
+        if self.pinned is not None:
+            return self.pinned
+        #
+
+        if self.source is None:
+            raise IOError("no source of data {%r}" % self.md5)
+        #
+
+        key = self.key()
+        data = DATA_CACHE.get(key)
+        if data is not None:
+            return data
+        #
+
+        if isinstance(self.source, basestring):
+            # from file (memory-mapped)
+            with open(self.source, "rb") as fp:
+                if self.size:
+                    m = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+                    data = m[:]
+                    m.close()
+                else:
+                    data = fp.read()
+                #
+            #
+            if hashlib.md5(data).hexdigest() != self.md5:
+                raise IOError("file is changed {%r}" % self.source)
+            #
+        else:
+            # from snapshot
+            data = self.source.blob(self.offset, self.size)
+        #
+
+        DATA_CACHE.put(key, data)
+        return data
+    #
+
+    def loaded(self):
+        """ return content (None if source file is changed or removed after scan)
+        """
+
+        try:
+            return self.content()
+        except IOError:
+            return None
+        #
+    #
+
+    def __getstate__(self):
+        """ data pointer (for snapshot) or data itself """
+
+        if self.source is None and self.pinned is None:
+            return self.size, self.md5, self.offset, None
+        #
+
+        return self.size, self.md5, None, self.content()
+    #
+
+    def __setstate__(self, state):
+        """"""
+
+        self.size, self.md5, self.offset, self.pinned = state
+        self.source = None
+    #
+
+    def __len__(self):
+        """"""
+
+        return self.size
+    #
+
+    def __nonzero__(self):
+        """"""
+
+        return self.size > 0
+    #
+
+    def __str__(self):
+        """"""
+
+        return self.content()
+    #
 #
 
 
-def load_picture_meta(name, info=False):
-    """ load meta-data from picture file
+# codecs: name -> (default level, magic)
+CODECS = {
+    "none": (0, None),
+    "zlib": (6, None),
+    "bz2": (9, "BZh"),
+    "lzma": (6, "\xfd7zXZ\x00"),
+}
 
-        :param name:
-        :param info:
+
+def pack_data(data, codec="bz2", level=None):
+    """ compress data
+
+        :param data:
+        :param codec: "none", "zlib", "bz2" or "lzma"
+        :param level: compression level (None - default for codec)
     """
 
-    meta = {}
-    tags = {}
+    if codec not in CODECS:
+        raise ValueError("unknown codec {%r}" % codec)
+    #
 
-    try:
-        image = Image.open(name)
-    except IOError, e:
-        print "ERROR :: {%r} {%r}" % (e, name)
-        raise
+    if level is None:
+        level = CODECS[codec][0]
     #
 
-    meta["width"], meta["height"] = image.size
-    if info:
-        meta["info"] = image.info
+    if codec == "zlib":
+        return zlib.compress(data, level)
+    elif codec == "bz2":
+        return bz2.compress(data, level)
+    elif codec == "lzma":
+        if not lzma:
+            raise ValueError("codec {%r} isn't available" % codec)
+        #
+        return lzma.compress(data, preset=level)
     #
 
-    return tags, meta
+    return data
 #
 
 
-def get_unicode(data):
-    """ return unicode string (if possible)
+def detect_codec(data):
+    """ detect codec by magic
 
-    :param data:
+        :param data:
     """
 
-    try:
-        return unicode(data)
-    except UnicodeError:
-        pass
+    for name, (_, magic) in CODECS.iteritems():
+        if magic and data[:len(magic)] == magic:
+            return name
+        #
     #
 
-    # use auto-detect
-    cp = chardet.detect(data)
-    en = cp.get('encoding', 'ascii')
-
-    try:
-        return unicode(data, en)
-    except UnicodeError:
-        pass
+    # zlib header: CM=8 and (CMF*256 + FLG) % 31 == 0
+    head = data[:2]
+    if len(head) == 2 and ord(head[0]) & 0x0f == 8 and (ord(head[0]) * 256 + ord(head[1])) % 31 == 0:
+        return "zlib"
     #
 
-    raise ValueError("can't encode as unicode for {%r}" % data)
+    return "none"
 #
 
 
-def get_bytes(data, encoding='utf-8-sig'):
-    """ return binary string (bytes) (if possible)
+def unpack_data(data, codec=None):
+    """ decompress data
 
         :param data:
-        :param encoding: default encoding for unicode data
-        :return:
+        :param codec: codec (None - detect by magic)
     """
 
-    if isinstance(data, str):
-        return data
+    if codec is None:
+        codec = detect_codec(data)
     #
 
-    if isinstance(data, unicode):
-        return data.encode(encoding)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    elif codec == "bz2":
+        return bz2.decompress(data)
+    elif codec == "lzma":
+        if not lzma:
+            raise ValueError("codec {%r} isn't available" % codec)
+        #
+        return lzma.decompress(data)
+    elif codec != "none":
+        raise ValueError("unknown codec {%r}" % codec)
     #
 
-    return str(data)
+    return data
+#
+
+
+# indexed snapshot: header (magic, codec, index offset, index size) + records + index
+FS_MAGIC = "MSPFS\x01\x00\x00"
+FS_HEADER = struct.Struct("<8s8sQQ")
+
+
+class FsFiles(collections.MutableMapping):
+    """ files of indexed snapshot (FsFile() is loaded on access) """
+
+    def __init__(self, data, entries, codec="zlib"):
+        """
+            :param data: snapshot data (string or mmap)
+            :param entries: index entries: (key, offset, size, file size, file mtime, md5, has-blob, type)
+            :param codec: records codec
+        """
+
+        self.data = data
+        self.codec = codec
+        self.entries = dict((entry[0], entry[1:]) for entry in entries)
+        self.files = {}
+    #
+
+    def raw(self, key):
+        """ return packed record (None if record is loaded/changed or has data in blob)
+
+            :param key:
+        """
+
+        entry = self.entries[key]
+        if key in self.files or entry is None or (len(entry) > 5 and entry[5]):
+            return None
+        #
+
+        offset, size = entry[:2]
+        return self.data[offset:offset + size]
+    #
+
+    def blob(self, offset, size):
+        """ return data from snapshot
+
+            :param offset:
+            :param size:
+        """
+
+        return self.data[offset:offset + size]
+    #
+
+    def info(self, key):
+        """ return (file size, file mtime, md5, type) without loading of record
+
+            :param key:
+        """
+
+        f = self.files.get(key)
+        if f is None:
+            entry = self.entries[key]
+            return entry[2:5] + (entry[6] if len(entry) > 6 else None,)
+        #
+
+        return f.stat.st_size, f.stat.st_mtime, f.md5, f.type
+    #
+
+    def peek(self, key):
+        """ return FsFile() (loaded record isn't kept)
+
+            :param key:
+        """
+
+        f = self.files.get(key)
+        if f is None:
+            offset, size = self.entries[key][:2]
+            f = pickle.loads(unpack_data(self.data[offset:offset + size], self.codec))
+            if isinstance(f.data, FsData) and f.data.source is None and f.data.pinned is None:
+                f.data.source = self
+            #
+        #
+
+        return f
+    #
+
+    def __getitem__(self, key):
+        """"""
+
+        f = self.files.get(key)
+        if f is None:
+            f = self.files[key] = self.peek(key)
+        #
+
+        return f
+    #
+
+    def __setitem__(self, key, value):
+        """"""
+
+        self.files[key] = value
+        if key not in self.entries:
+            self.entries[key] = None
+        #
+    #
+
+    def __delitem__(self, key):
+        """"""
+
+        del self.entries[key]
+        self.files.pop(key, None)
+    #
+
+    def __contains__(self, key):
+        """"""
+
+        return key in self.entries
+    #
+
+    def __iter__(self):
+        """"""
+
+        return iter(self.entries)
+    #
+
+    def __len__(self):
+        """"""
+
+        return len(self.entries)
+    #
 #
 
 
-def get_hex(n, size=0, radix=string.hexdigits):
-    """ get hex string from integer
+# sqlite snapshot
+DB_MAGIC = "SQLite format 3\x00"
+
+
+class FsDb(object):
+    """ sqlite store of Fs() (one row per FsFile) """
+
+    def __init__(self, name):
+        """
+            :param name: sqlite file
+        """
+
+        self.name = name
+        self.db = sqlite3.connect(name)
+        self.db.text_factory = str
+
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value BLOB)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, path TEXT, file TEXT, type TEXT, "
+                            "suffix TEXT, size INTEGER, mtime REAL, md5 TEXT, record BLOB)")
+            # inode (for lookup of files by stat, see by_stat()) is added to stores of old versions
+            if "inode" not in [row[1] for row in self.db.execute("PRAGMA table_info(files)")]:
+                self.db.execute("ALTER TABLE files ADD COLUMN inode INTEGER")
+                inodes = [(pickle.loads(zlib.decompress(record)).stat.st_ino, name)
+                          for name, record in self.db.execute("SELECT name, record FROM files")]
+                self.db.executemany("UPDATE files SET inode = ? WHERE name = ?", inodes)
+            #
+            for column in ("suffix", "md5", "size"):
+                self.db.execute("CREATE INDEX IF NOT EXISTS files_%s ON files (%s)" % (column, column))
+            #
+            self.db.execute("CREATE INDEX IF NOT EXISTS files_stat ON files (size, mtime)")
+            # query index (see FsQuery): tag values & numeric columns of files
+            self.db.execute("CREATE TABLE IF NOT EXISTS query_tags (name TEXT, tag TEXT, value TEXT)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS query_columns (name TEXT, col TEXT, value REAL)")
+            for table, column in (("query_tags", "tag"), ("query_columns", "col")):
+                self.db.execute("CREATE INDEX IF NOT EXISTS %s_name ON %s (name)" % (table, table))
+                self.db.execute("CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s, value)" % (table, column, table, column))
+            #
+        #
+    #
+
+    @staticmethod
+    def row(name, f):
+        """ return row for file
+
+            :param name:
+            :param f: FsFile()
+        """
+
+        suffix = os.path.splitext(f.name or "")[1].lower() or None
+        record = sqlite3.Binary(zlib.compress(pickle.dumps(f, protocol=-1)))
+        # file with changed/removed source of data is saved as "REF" (see FsFile.__getstate__())
+        f_type = "REF" if isinstance(f.data, FsData) and f.data.loaded() is None else f.type
+        return (get_unicode(name), get_unicode(f.path or ""), get_unicode(f.name or ""), f_type, suffix,
+                f.stat.st_size, f.stat.st_mtime, f.md5, record, f.stat.st_ino)
+    #
+
+    def write(self, root, index, files, deleted=(), full=False):
+        """ write files (single transaction)
+
+            :param root:
+            :param index:
+            :param files: iterable of (name, FsFile())
+            :param deleted: names of deleted files
+            :param full: replace all files
+        """
+
+        deleted = [(get_unicode(name),) for name in deleted]
+
+        with self.db:
+            for table in ("files", "query_tags", "query_columns"):
+                if full:
+                    self.db.execute("DELETE FROM %s" % table)
+                #
+                self.db.executemany("DELETE FROM %s WHERE name = ?" % table, deleted)
+            #
+            for name, f in files:
+                row = self.row(name, f)
+                self.db.execute("INSERT OR REPLACE INTO files (name, path, file, type, suffix, size, mtime, md5, "
+                                "record, inode) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+                self.query_update(row[0], f, clear=not full)
+            #
+            info = [("root", sqlite3.Binary(pickle.dumps(root, protocol=-1))),
+                    ("index", sqlite3.Binary(zlib.compress(pickle.dumps(index, protocol=-1))))]
+            if full:
+                info.append(("query", 1))
+            #
+            self.db.executemany("INSERT OR REPLACE INTO info VALUES (?, ?)", info)
+        #
+    #
+
+    def query_update(self, name, f, clear=True):
+        """ write rows of query index for file (in transaction)
+
+            :param name: name of file (unicode)
+            :param f: FsFile()
+            :param clear: delete old rows of file
+        """
+
+        if clear:
+            self.db.execute("DELETE FROM query_tags WHERE name = ?", (name,))
+            self.db.execute("DELETE FROM query_columns WHERE name = ?", (name,))
+        #
+
+        if f.type == "DIR":
+            return
+        #
+
+        tags, columns = FsQuery.values(f)
+        self.db.executemany("INSERT INTO query_tags VALUES (?, ?, ?)", ((name, tag, value) for tag, value in tags))
+        self.db.executemany("INSERT INTO query_columns VALUES (?, ?, ?)",
+                            ((name, col, value) for col, value in columns))
+    #
+
+    def query_build(self):
+        """ (re)build query index from records (for store written without query index)
+        """
+
+        with self.db:
+            self.db.execute("DELETE FROM query_tags")
+            self.db.execute("DELETE FROM query_columns")
+            for name, record in self.db.execute("SELECT name, record FROM files"):
+                self.query_update(get_unicode(name), pickle.loads(zlib.decompress(record)), clear=False)
+            #
+            self.db.execute("INSERT OR REPLACE INTO info VALUES (?, ?)", ("query", 1))
+        #
+    #
+
+    def query_find(self, field, op, value):
+        """ return names of files matching condition (see FsQuery.find()), query index is built on demand
+
+            :param field: tag or numeric column
+            :param op:
+            :param value:
+            :return: set of names
+        """
+
+        if not self.db.execute("SELECT 1 FROM info WHERE key = 'query'").fetchone():
+            self.query_build()
+        #
+
+        if field in QUERY_COLUMNS and op in QUERY_OPS:
+            sql = "SELECT name FROM query_columns WHERE col = ? AND value %s ?" % op
+            params = (field, float(value))
+        elif op == "=":
+            sql = "SELECT name FROM query_tags WHERE tag = ? AND value = ?"
+            params = (field, get_unicode(value).lower())
+        else:
+            raise ValueError("unsupported condition: %s%s%s" % (field, op, value))
+        #
+
+        return set(get_unicode(row[0]) for row in self.db.execute(sql, params))
+    #
+
+    def info(self):
+        """ return (root, index)
+        """
+
+        data = dict(self.db.execute("SELECT key, value FROM info"))
+        root = pickle.loads(str(data["root"])) if "root" in data else None
+        index = pickle.loads(zlib.decompress(data["index"])) if "index" in data else {}
+        return root, index
+    #
+
+    def get(self, name):
+        """ return FsFile() (None if not found)
+
+            :param name:
+        """
+
+        row = self.db.execute("SELECT record FROM files WHERE name = ?", (get_unicode(name),)).fetchone()
+        return pickle.loads(zlib.decompress(row[0])) if row else None
+    #
+
+    def by_stat(self, size, mtime, inode):
+        """ return name of file by stat (None if not found)
+
+            :param size:
+            :param mtime:
+            :param inode:
+        """
+
+        sql = "SELECT name FROM files WHERE size = ? AND mtime = ? AND inode = ?"
+        row = self.db.execute(sql, (size, mtime, inode)).fetchone()
+        return get_unicode(row[0]) if row else None
+    #
+
+    def stat(self, name):
+        """ return (file size, file mtime, md5, type) (None if not found)
+
+            :param name:
+        """
+
+        sql = "SELECT size, mtime, md5, type FROM files WHERE name = ?"
+        return self.db.execute(sql, (get_unicode(name),)).fetchone()
+    #
+
+    def names(self):
+        """ return names of files (sorted)
+        """
+
+        return (get_unicode(row[0]) for row in self.db.execute("SELECT name FROM files ORDER BY name"))
+    #
+
+    def find(self, suffix=None, md5=None, size=None):
+        """ find files (by indexed columns)
+
+            :param suffix: lower-case suffix (with dot)
+            :param md5:
+            :param size:
+            :return: generator of (name, file size, file mtime, md5)
+        """
+
+        where = []
+        params = []
+        for column, value in (("suffix", suffix), ("md5", md5), ("size", size)):
+            if value is not None:
+                where.append("%s = ?" % column)
+                params.append(value)
+            #
+        #
+
+        sql = "SELECT name, size, mtime, md5 FROM files"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        #
+
+        for row in self.db.execute(sql + " ORDER BY name", params):
+            yield (get_unicode(row[0]),) + tuple(row[1:])
+        #
+    #
+
+    def __len__(self):
+        """"""
+
+        return self.db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+    #
+#
+
+
+class FsDbFiles(collections.MutableMapping):
+    """ files of sqlite store (FsFile() is loaded on access, changes are kept until flush()) """
+
+    def __init__(self, db):
+        """
+            :param db: FsDb()
+        """
+
+        self.db = db
+        self.files = {}
+        self.deleted = set()
+    #
+
+    def flush(self, root, index):
+        """ write changes (upsert changed and delete purged files)
+
+            :param root:
+            :param index:
+        """
+
+        self.db.write(root, index, self.files.iteritems(), self.deleted)
+        self.files = {}
+        self.deleted = set()
+    #
+
+    def info(self, key):
+        """ return (file size, file mtime, md5, type) without loading of record
+
+            :param key:
+        """
+
+        f = self.files.get(key)
+        if f is None:
+            return tuple(self.db.stat(key))
+        #
+
+        return f.stat.st_size, f.stat.st_mtime, f.md5, f.type
+    #
+
+    def peek(self, key):
+        """ return FsFile() (loaded record isn't kept)
+
+            :param key:
+        """
+
+        return self[key]
+    #
+
+    def __getitem__(self, key):
+        """"""
+
+        f = self.files.get(key)
+        if f is None:
+            f = None if key in self.deleted else self.db.get(key)
+            if f is None:
+                raise KeyError(key)
+            #
+        #
+
+        return f
+    #
+
+    def __setitem__(self, key, value):
+        """"""
+
+        self.files[key] = value
+        self.deleted.discard(key)
+    #
+
+    def __delitem__(self, key):
+        """"""
+
+        if key not in self:
+            raise KeyError(key)
+        #
+
+        self.files.pop(key, None)
+        if self.db.stat(key):
+            self.deleted.add(key)
+        #
+    #
+
+    def __contains__(self, key):
+        """"""
+
+        return key in self.files or (key not in self.deleted and self.db.stat(key) is not None)
+    #
+
+    def __iter__(self):
+        """"""
+
+        for key in self.db.names():
+            if key not in self.deleted and key not in self.files:
+                yield key
+            #
+        #
+
+        for key in self.files.keys():
+            yield key
+        #
+    #
+
+    def __len__(self):
+        """"""
+
+        return len(self.db) - len(self.deleted) + sum(1 for key in self.files if self.db.stat(key) is None)
+    #
+#
+
+
+QUERY_COLUMNS = ("size", "sample_rate", "bits_per_sample", "channels", "length", "width", "height")
+QUERY_OPS = ("<=", ">=", "=", "<", ">")
+
+
+class FsQuery(object):
+    """ query index over tags & meta-data: tag value (lower-case) -> names, numeric columns
+        (sorted on demand and saved sorted)
+    """
+
+    def __init__(self):
+        """"""
+
+        self.tags = {}
+        self.columns = dict((col, {}) for col in QUERY_COLUMNS)
+        self.sorted = {}
+    #
+
+    def __getstate__(self):
+        """"""
+
+        return self.tags, self.columns, dict((col, self.column(col)) for col in self.columns)
+    #
+
+    def __setstate__(self, state):
+        """"""
+
+        self.tags, self.columns, self.sorted = state
+    #
+
+    @staticmethod
+    def values(f):
+        """ return indexed values of file: (tags, numeric columns)
+
+            :param f: FsFile()
+        """
+
+        tags = []
+        for tag, values in (f.tags or {}).iteritems():
+            for value in values if isinstance(values, (list, tuple)) else [values]:
+                tags.append((tag, get_unicode(value).lower()))
+            #
+        #
+
+        meta = f.meta or {}
+        columns = [(col, meta.get(col)) for col in QUERY_COLUMNS[1:]]
+        columns.append(("size", f.stat.st_size))
+
+        return tags, [(col, value) for col, value in columns if isinstance(value, (int, long, float))]
+    #
+
+    def add(self, name, f):
+        """ add file to index
+
+            :param name:
+            :param f: FsFile()
+        """
+
+        if f.type == "DIR":
+            return
+        #
+
+        tags, columns = self.values(f)
+        for tag, value in tags:
+            self.tags.setdefault(tag, {}).setdefault(value, set()).add(name)
+        #
+        for col, value in columns:
+            self.columns[col][name] = value
+            self.sorted.pop(col, None)
+        #
+    #
+
+    def remove(self, name, f):
+        """ remove file from index
+
+            :param name:
+            :param f: FsFile() (indexed record)
+        """
+
+        if f.type == "DIR":
+            return
+        #
+
+        tags, columns = self.values(f)
+        for tag, value in tags:
+            names = self.tags.get(tag, {}).get(value)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self.tags[tag][value]
+                #
+            #
+        #
+        for col, _ in columns:
+            if self.columns[col].pop(name, None) is not None:
+                self.sorted.pop(col, None)
+            #
+        #
+    #
+
+    def column(self, col):
+        """ return sorted column: (values, names)
+
+            :param col:
+        """
+
+        if col not in self.sorted:
+            column = self.columns[col]
+            names = sorted(column, key=column.__getitem__)
+            self.sorted[col] = ([column[name] for name in names], names)
+        #
+
+        return self.sorted[col]
+    #
+
+    def find(self, conds):
+        """ find files by conditions (all conditions must match)
+
+            :param conds: list of (field, op, value): for tag op is "=" (case-insensitive),
+                          for numeric column op is "=", "<", "<=", ">", ">="
+            :return: set of names
+        """
+
+        result = None
+
+        for field, op, value in conds:
+            if field in self.columns:
+                values, names = self.column(field)
+                value = float(value)
+                lo, hi = 0, len(values)
+                if op in ("=", ">="):
+                    lo = bisect.bisect_left(values, value)
+                elif op == ">":
+                    lo = bisect.bisect_right(values, value)
+                #
+                if op in ("=", "<="):
+                    hi = bisect.bisect_right(values, value)
+                elif op == "<":
+                    hi = bisect.bisect_left(values, value)
+                #
+                found = set(names[lo:hi])
+            elif op == "=":
+                found = self.tags.get(field, {}).get(get_unicode(value).lower(), set())
+            else:
+                raise ValueError("unsupported condition: %s%s%s" % (field, op, value))
+            #
+
+            result = set(found) if result is None else result & found
+            if not result:
+                break
+            #
+        #
+
+        return result or set()
+    #
+#
+
+
+class FsDbQuery(object):
+    """ query index of sqlite store (tables are written with records by FsDb.write(),
+        changes which aren't flushed yet are matched in-memory)
+    """
+
+    def __init__(self, files):
+        """
+            :param files: FsDbFiles()
+        """
+
+        self.files = files
+    #
+
+    def add(self, name, f):
+        """ changed file is indexed by flush()
+
+            :param name:
+            :param f:
+        """
+
+        pass
+    #
+
+    def remove(self, name, f):
+        """ purged file is removed by flush()
+
+            :param name:
+            :param f:
+        """
+
+        pass
+    #
+
+    def find(self, conds):
+        """ find files by conditions (see FsQuery.find())
+
+            :param conds: list of (field, op, value)
+            :return: set of names
+        """
+
+        result = None
+        for field, op, value in conds:
+            found = self.files.db.query_find(field, op, value)
+            result = found if result is None else result & found
+            if not result:
+                break
+            #
+        #
+
+        changes = FsQuery()
+        for name, f in self.files.files.iteritems():
+            changes.add(name, f)
+        #
+        changed = set(get_unicode(name) for name in self.files.files) | self.files.deleted
+
+        return ((result or set()) - changed) | changes.find(conds)
+    #
+#
+
+
+class FsDbStats(object):
+    """ files of sqlite store by stat: (size, mtime, inode) -> name (indexed columns of files, see FsDb.by_stat()) """
+
+    def __init__(self, db):
+        """
+            :param db: FsDb()
+        """
+
+        self.db = db
+    #
+
+    def get(self, key, default=None):
+        """ return name of file (changes which aren't flushed yet aren't found)
+
+            :param key: (size, mtime, inode)
+            :param default:
+        """
+
+        name = self.db.by_stat(*key)
+        return default if name is None else name
+    #
+
+    def pop(self, key, default=None):
+        """ row of purged/changed file is updated by flush()
+
+            :param key:
+            :param default:
+        """
+
+        return default
+    #
+
+    def __setitem__(self, key, name):
+        """ row of saved file is written by flush() """
+
+        pass
+    #
+#
+
+
+def parse_query(expr):
+    """ parse condition "field<op>value" (e.g. "artist=X", "bits_per_sample>=24")
+
+        :param expr:
+        :return: (field, op, value)
+    """
+
+    for op in QUERY_OPS:
+        field, _op, value = expr.partition(op)
+        if _op and field and "=" not in field and "<" not in field and ">" not in field:
+            return field.strip().lower(), op, value.strip()
+        #
+    #
+
+    raise ValueError("bad condition: %s" % expr)
+#
+
+
+def load_audio_meta(name):
+    """ load meta-data from audio file
+
+        :param name:
+    """
+
+    info_tags = ('bits_per_sample', 'channels', 'md5_signature', 'sample_rate', 'total_samples', 'length')
+
+    meta = {}
+    tags = {}
+    audio = mutagen.File(name, easy=True)
+
+    # tags
+    for key in audio:
+        tags[key] = audio[key]
+    #
+
+    # meta
+    for key in info_tags:
+        meta[key] = getattr(audio.info, key, None)
+    #
+
+    return tags, meta
+#
+
+
+def load_picture_meta(name, info=False):
+    """ load meta-data from picture file
+
+        :param name:
+        :param info:
+    """
+
+    meta = {}
+    tags = {}
+
+    try:
+        image = Image.open(name)
+    except IOError, e:
+        print "ERROR :: {%r} {%r}" % (e, name)
+        raise
+    #
+
+    meta["width"], meta["height"] = image.size
+    if info:
+        meta["info"] = image.info
+    #
+
+    return tags, meta
+#
+
+
+def load_video_meta(name):
+    """ load meta-data from video file (by ffprobe)
+
+        :param name:
+    """
+
+    cmd = [FFPROBE, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", name]
+    info = json.loads(subprocess.check_output(cmd))
+
+    meta = {}
+    tags = {}
+
+    fmt = info.get("format", {})
+    for key, value in fmt.get("tags", {}).iteritems():
+        tags[key.lower()] = [value]
+    #
+
+    meta["format"] = fmt.get("format_name")
+    meta["length"] = float(fmt.get("duration") or 0)
+
+    for stream in info.get("streams", []):
+        kind = stream.get("codec_type")
+        if kind == "video" and "width" not in meta:
+            meta["width"], meta["height"] = stream.get("width"), stream.get("height")
+            meta["video_codec"] = stream.get("codec_name")
+        elif kind == "audio" and "sample_rate" not in meta:
+            meta["sample_rate"] = int(stream.get("sample_rate") or 0)
+            meta["channels"] = stream.get("channels")
+            meta["audio_codec"] = stream.get("codec_name")
+        #
+    #
+
+    return tags, meta
+#
+
+
+def load_pdf_meta(name, limit=64 << 20):
+    """ load meta-data from pdf file (pages & version by scan of objects, without pdf library)
+
+        :param name:
+        :param limit: max size of scanned data
+    """
+
+    with open(name, "rb") as f:
+        data = f.read(limit)
+    #
+
+    if not data.startswith("%PDF-"):
+        raise ValueError("not pdf: %s" % name)
+    #
+
+    meta = {"version": data[5:8], "pages": len(PDF_PAGE.findall(data))}
+    tags = {}
+
+    title = PDF_TITLE.search(data)
+    if title:
+        tags["title"] = [get_unicode(title.group(1))]
+    #
+
+    return tags, meta
+#
+
+
+PDF_PAGE = re.compile(r"/Type\s*/Page(?![a-zA-Z])")
+PDF_TITLE = re.compile(r"/Title\s*\(([^)]*)\)")
+
+
+# lines with non-ascii bytes (sample for chardet)
+NON_ASCII_LINE = re.compile(r'[^\n]*[\x80-\xff][^\n]*')
+
+
+def get_unicode(data):
+    """ return unicode string (if possible): ascii, strict utf-8, chardet over sample of non-ascii lines
+
+    :param data:
+    """
+
+    try:
+        return unicode(data)
+    except UnicodeError:
+        pass
+    #
+
+    try:
+        return unicode(data, 'utf-8')
+    except UnicodeError:
+        pass
+    #
+
+    # use auto-detect (by sample of lines with non-ascii bytes)
+    sample = "\n".join(NON_ASCII_LINE.findall(data[:1 << 16]))[:4096]
+    cp = chardet.detect(sample)
+    en = cp.get('encoding') or 'ascii'
+
+    try:
+        return unicode(data, en)
+    except UnicodeError:
+        pass
+    #
+
+    raise ValueError("can't encode as unicode for {%r}" % data)
+#
+
+
+def get_bytes(data, encoding='utf-8-sig'):
+    """ return binary string (bytes) (if possible)
+
+        :param data: string, unicode or object with __str__ (e.g. FsData)
+        :param encoding: default encoding for unicode data
+        :return:
+    """
+
+    if isinstance(data, str):
+        return data
+    #
+
+    if isinstance(data, unicode):
+        return data.encode(encoding)
+    #
+
+    return str(data)
+#
+
+
+def get_hex(n, size=0, radix=string.hexdigits):
+    """ get hex string from integer
+
+        :param n:
+        :param size:
+        :param radix:
+    """
+
+    if n is None:
+        return None
+    #
+
+    a = []
+
+    while True:
+        n, r = divmod(n, 16)
+        a.append(r)
+        if not n:
+            if not size or len(a) >= size:
+                break
+            #
+        #
+    #
+
+    a.reverse()
+    return "".join([radix[n] for n in a])
+#
+
+
+def list_dir(path):
+    """ list folder with one stat per entry (at most)
+
+        :param path:
+        :return: list of (name, stat, is-folder) (is-folder is false for symlinks)
+    """
+
+    entries = []
+
+    if scandir:
+        for entry in scandir(path):
+            try:
+                st = entry.stat()
+            except OSError:
+                # dangling symlink
+                continue
+            #
+            entries.append((entry.name, st, entry.is_dir(follow_symlinks=False)))
+        #
+
+        return entries
+    #
+
+    for name in os.listdir(path):
+        _name = os.path.join(path, name)
+        try:
+            st = os.lstat(_name)
+            is_dir = stat.S_ISDIR(st.st_mode)
+            if stat.S_ISLNK(st.st_mode):
+                st = os.stat(_name)
+            #
+        except OSError:
+            continue
+        #
+        entries.append((name, st, is_dir))
+    #
+
+    return entries
+#
+
+
+def sign_name(name, hashfunc=hashlib.md5):
+    """ signature of name (as integer)
+
+        :param name:
+        :param hashfunc: hash function
+    """
+
+    return int(hashfunc(get_bytes(name, 'utf-8')).hexdigest(), 16)
+#
+
+
+def merkle_leaf(name, f):
+    """ merkle leaf of file/folder (name, size & content hash or md5 for file, merkle hash for folder)
+
+        :param name: name in folder
+        :param f: FsFile()
+    """
+
+    if f.type == "DIR":
+        return "%s\x00D\x00%s\n" % (get_bytes(name, 'utf-8'), f.md5 or "")
+    #
+
+    return "%s\x00%d\x00%s\n" % (get_bytes(name, 'utf-8'), f.stat.st_size, f.hash or f.md5 or "")
+#
+
+
+def is_same_folder(st1, st2):
+    """ check if folder isn't changed (folder listing is the same)
+
+        :param st1: stat
+        :param st2: stat
+    """
+
+    return st1.st_ino == st2.st_ino and st1.st_mtime == st2.st_mtime and st1.st_ctime == st2.st_ctime
+#
+
+
+def mk_suffixes(classes):
+    """ make suffix lookup table
+
+        :param classes: class -> suffixes
+        :return: suffix (lower-case) -> class
+    """
+
+    suffixes = {}
+
+    for name, suffs in classes.iteritems():
+        for suff in suffs:
+            suffixes[suff.lower()] = name
+        #
+    #
+
+    return suffixes
+#
+
+
+# chunk size for streaming reads
+CHUNK_SIZE = 1 << 20
+
+
+def read_full(name, limit=None, chunk=CHUNK_SIZE):
+    """ read file in chunks and calculate md5 (single pass)
+
+        :param name:
+        :param limit: max size of kept data (None - unlimited)
+        :param chunk: chunk size
+        :return: data (None if size is over limit), md5 (as hex)
+    """
+
+    h = hashlib.md5()
+    chunks = []
+    size = 0
+
+    with open(name, "rb") as fp:
+        while True:
+            data = fp.read(chunk)
+            if not data:
+                break
+            #
+
+            h.update(data)
+            size += len(data)
+
+            if chunks is not None:
+                if limit is not None and size > limit:
+                    # drop data (keep hash only)
+                    chunks = None
+                else:
+                    chunks.append(data)
+                #
+            #
+        #
+    #
+
+    return "".join(chunks) if chunks is not None else None, h.hexdigest()
+#
+
+
+# content hash algorithms (by preference)
+HASH_ALGOS = ("xxh64", "blake2b", "sha1")
+
+
+def hash_new(algo):
+    """ return new hash object
+
+        :param algo: hash name (from hashlib or xxhash)
+    """
+
+    if algo.startswith("xxh"):
+        fn = getattr(xxhash, algo, None) if xxhash else None
+        if not fn:
+            raise ValueError("unsupported hash type {%r}" % algo)
+        #
+        return fn()
+    #
+
+    return hashlib.new(algo)
+#
+
+
+def hash_algo(algo=None):
+    """ return available hash name
+
+        :param algo: hash name (None or "auto" - first available from HASH_ALGOS)
+    """
+
+    if algo and algo != "auto":
+        hash_new(algo)
+        return algo
+    #
+
+    for algo in HASH_ALGOS:
+        try:
+            hash_new(algo)
+            return algo
+        except ValueError:
+            pass
+        #
+    #
+
+    return "md5"
+#
+
+
+def audio_payload(fp):
+    """ return audio payload ranges (without tags) for audio file
+
+        :param fp: opened file
+        :return: list of (offset, size)
+    """
+
+    fp.seek(0, os.SEEK_END)
+    end = fp.tell()
+    fp.seek(0)
+    start = 0
+
+    head = fp.read(10)
+
+    # ID3v2 (header + syncsafe size (+ footer))
+    if head.startswith("ID3") and len(head) == 10:
+        size = 0
+        for c in head[6:10]:
+            size = (size << 7) | (ord(c) & 0x7f)
+        #
+        start = 10 + size + (10 if ord(head[5]) & 0x10 else 0)
+        fp.seek(start)
+        head = fp.read(4)
+    #
+
+    # FLAC (skip metadata blocks)
+    if head.startswith("fLaC"):
+        start += 4
+        while True:
+            fp.seek(start)
+            block = fp.read(4)
+            if len(block) != 4:
+                break
+            #
+            start += 4 + ((ord(block[1]) << 16) | (ord(block[2]) << 8) | ord(block[3]))
+            if ord(block[0]) & 0x80:
+                break
+            #
+        #
+    #
+
+    # Ogg (page bodies of audio pages): header pages have zero granule position, pages of header packet
+    # spanning pages (comment with cover art) have -1, so all pages before first positive granule are skipped
+    # (zero granule starts headers of next chained stream)
+    if head.startswith("OggS"):
+        ranges = []
+        offset = start
+        audio = False
+        while offset < end:
+            fp.seek(offset)
+            page = fp.read(27)
+            if len(page) != 27 or not page.startswith("OggS"):
+                break
+            #
+            segments = fp.read(ord(page[26]))
+            size = sum(ord(c) for c in segments)
+            body = offset + 27 + len(segments)
+            granule = struct.unpack("<q", page[6:14])[0]
+            audio = granule > 0 or (audio and granule != 0)
+            if audio:
+                ranges.append((body, size))
+            #
+            offset = body + size
+        #
+        return ranges
+    #
+
+    # trailing tags: ID3v1, APEv2
+    while end > start:
+        fp.seek(max(end - 128, 0))
+        tail = fp.read(128)
+        if len(tail) == 128 and tail.startswith("TAG"):
+            end -= 128
+            continue
+        #
+        if tail[-32:].startswith("APETAGEX"):
+            footer = tail[-32:]
+            size = sum(ord(c) << (8 * i) for i, c in enumerate(footer[12:16]))
+            flags = sum(ord(c) << (8 * i) for i, c in enumerate(footer[20:24]))
+            end -= size + (32 if flags & 0x80000000 else 0)
+            continue
+        #
+        break
+    #
+
+    return [(start, end - start)] if end > start else []
+#
+
+
+def hash_audio(name, algo, chunk=CHUNK_SIZE):
+    """ calculate hash of audio payload (tags are ignored, so re-tagging doesn't change it)
+
+        :param name:
+        :param algo: hash name
+        :param chunk: chunk size
+        :return: hash as "algo:hex"
+    """
+
+    h = hash_new(algo)
+
+    with open(name, "rb") as fp:
+        for offset, size in audio_payload(fp):
+            fp.seek(offset)
+            while size > 0:
+                data = fp.read(min(chunk, size))
+                if not data:
+                    break
+                #
+                h.update(data)
+                size -= len(data)
+            #
+        #
+    #
+
+    return "%s:%s" % (algo, h.hexdigest())
+#
+
+
+Extractor = collections.namedtuple("Extractor", "name fn suffixes timeout isolation")
+
+# meta-data extractors (by suffix class)
+EXTRACTORS = collections.OrderedDict()
+
+
+def register_extractor(name, fn, suffixes, timeout=None, isolation="inline"):
+    """ register meta-data extractor for suffix class (replace existing)
+
+        :param name: suffix class (used by Fs.classify())
+        :param fn: extractor: fn(file name) -> (tags, meta)
+        :param suffixes: default suffixes of class
+        :param timeout: max time of call (seconds, None - not limited)
+        :param isolation: "inline" (in scan worker, timeout by thread) or "process" (in forked process)
+        :return: Extractor()
+    """
+
+    if isolation not in ("inline", "process"):
+        raise ValueError("unknown isolation mode {%r}" % isolation)
+    #
+
+    extractor = EXTRACTORS[name] = Extractor(name, fn, tuple(suffixes), timeout, isolation)
+    return extractor
+#
+
+
+def run_thread(fn, name, timeout):
+    """ call fn(name) in thread (hung thread is abandoned after timeout)
+
+        :param fn:
+        :param name:
+        :param timeout: seconds
+    """
+
+    result = []
+
+    def target():
+        """"""
+
+        try:
+            result.append((True, fn(name)))
+        except Exception, e:
+            result.append((False, e))
+        #
+    #
+
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+
+    if not result:
+        raise RuntimeError("timeout {%r} {%r}" % (timeout, name))
+    #
+
+    ok, value = result[0]
+    if not ok:
+        raise value
+    #
+
+    return value
+#
+
+
+def run_process(fn, name, timeout):
+    """ call fn(name) in forked process (killed after timeout), result is passed by pipe
+
+        :param fn:
+        :param name:
+        :param timeout: seconds (None - not limited)
+    """
+
+    r, w = os.pipe()
+    pid = os.fork()
+
+    if not pid:
+        # child
+        os.close(r)
+        try:
+            data = pickle.dumps((True, fn(name)), protocol=-1)
+        except BaseException, e:
+            data = pickle.dumps((False, "%s: %s" % (type(e).__name__, e)), protocol=-1)
+        #
+        with os.fdopen(w, "wb") as f:
+            f.write(data)
+        #
+        os._exit(0)
+    #
+
+    os.close(w)
+    chunks = []
+    stop = time.time() + timeout if timeout else None
+
+    try:
+        with os.fdopen(r, "rb") as f:
+            while True:
+                wait = max(0.0, stop - time.time()) if stop else None
+                if not select.select([f], [], [], wait)[0]:
+                    os.kill(pid, signal.SIGKILL)
+                    raise RuntimeError("timeout {%r} {%r}" % (timeout, name))
+                #
+                chunk = os.read(f.fileno(), 1 << 16)
+                if not chunk:
+                    break
+                #
+                chunks.append(chunk)
+            #
+        #
+    finally:
+        os.waitpid(pid, 0)
+    #
+
+    if not chunks:
+        raise RuntimeError("extractor process failed {%r}" % name)
+    #
+
+    ok, value = pickle.loads("".join(chunks))
+    if not ok:
+        raise RuntimeError(value)
+    #
+
+    return value
+#
+
+
+def run_extractor(extractor, name):
+    """ call extractor (with timeout & isolation)
+
+        :param extractor: Extractor()
+        :param name: file name
+        :return: (tags, meta)
+    """
+
+    if extractor.isolation == "process":
+        return run_process(extractor.fn, name, extractor.timeout)
+    #
+
+    if extractor.timeout:
+        return run_thread(extractor.fn, name, extractor.timeout)
+    #
+
+    return extractor.fn(name)
+#
+
+
+# library extractors are called inline without timeout (watchdog thread/forked process per file costs more than
+# extraction itself), see set_extractors() for untrusted files; ffprobe is external process anyway
+register_extractor("meta_a", load_audio_meta, (".flac", ".ape", ".wv", ".mp3", ".opus", ".ogg"))
+register_extractor("meta_p", load_picture_meta, (".bmp", ".jpg", ".jpeg", ".gif", ".png", ".tif", ".tiff"))
+register_extractor("meta_d", load_pdf_meta, (".pdf",))
+if FFPROBE:
+    register_extractor("meta_v", load_video_meta, (".mkv", ".mp4", ".m4v", ".avi", ".vob", ".mov"), timeout=120,
+                       isolation="process")
+#
+
+
+def set_extractors(timeout=None, isolation=None):
+    """ set timeout/isolation of all registered extractors (re-registered, e.g. for untrusted files)
+
+        :param timeout: max time of call (seconds, None - keep)
+        :param isolation: "inline" or "process" (None - keep)
+    """
+
+    for extractor in EXTRACTORS.values():
+        register_extractor(extractor.name, extractor.fn, extractor.suffixes, timeout=timeout or extractor.timeout,
+                           isolation=isolation or extractor.isolation)
+    #
+#
+
+
+def load_file(job):
+    """ load data/meta-data for file (scan worker)
+
+        :param job: (file name, FsFile(), suffix class, options)
+        :return: FsFile()
+    """
+
+    name, f, _class, opts = job
+
+    if _class == "full":
+        data, f.md5 = read_full(name, limit=opts.get("full_limit"))
+        if data is None:
+            # too big: only md5 & size are saved (data is referenced by path)
+            f.type = "REF"
+        else:
+            f.data = FsData(len(data), f.md5, source=os.path.abspath(name), data=data)
+        #
+    elif _class in EXTRACTORS:
+        # meta-data can be set from cache
+        if f.meta is None:
+            try:
+                f.tags, f.meta = run_extractor(EXTRACTORS[_class], name)
+            except Exception, e:
+                print "ERROR :: {%s} {%r} {%r}" % (_class, e, name)
+                f.tags, f.meta = {}, {"error": "%s: %s" % (type(e).__name__, e)}
+            #
+        #
+        f.md5 = get_hex(f.meta.get("md5_signature"), size=32)
+        if _class == "meta_a" and opts.get("content_hash") and not f.hash:
+            f.hash = hash_audio(name, opts["content_hash"])
+        #
+    #
+
+    return f
+#
+
+
+def mk_pool(workers, mode="thread"):
+    """ make worker pool for scanner
+
+        :param workers: total workers
+        :param mode: "thread" or "process"
+        :return: pool
+    """
+
+    if mode == "process":
+        return multiprocessing.Pool(workers)
+    #
+
+    if mode == "thread":
+        return multiprocessing.pool.ThreadPool(workers)
+    #
+
+    raise ValueError("unknown pool mode {%r}" % mode)
+#
+
+
+class Inotify(object):
+    """ linux inotify (by ctypes): watch folders for changes """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_NONBLOCK = 0x00000800
+    IN_CLOEXEC = 0x00080000
+
+    MASK = (IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+            IN_MOVE_SELF | IN_ONLYDIR)
+
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self):
+        """"""
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        #
+
+        self.paths = {}  # wd -> path
+        self.wds = {}  # path -> wd
+    #
+
+    def add(self, path):
+        """ watch folder
+
+            :param path:
+        """
+
+        if path in self.wds:
+            return self.wds[path]
+        #
+
+        wd = self.libc.inotify_add_watch(self.fd, get_bytes(path, 'utf-8'), self.MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                return None
+            #
+            raise OSError(err, "inotify_add_watch", path)
+        #
+
+        self.paths[wd], self.wds[path] = path, wd
+        return wd
+    #
+
+    def remove(self, path):
+        """ stop watching folder
+
+            :param path:
+        """
+
+        wd = self.wds.pop(path, None)
+        if wd is not None:
+            self.paths.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+        #
+    #
+
+    def read(self, timeout=None):
+        """ read events
+
+            :param timeout: seconds (None - wait)
+            :return: list of (folder, mask, name), folder is None for queue overflow
+        """
+
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        #
+
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except OSError, e:
+            if e.errno == errno.EAGAIN:
+                return []
+            #
+            raise
+        #
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, size = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + size].rstrip("\x00")
+            offset += size
+
+            if mask & self.IN_Q_OVERFLOW:
+                events.append((None, mask, None))
+                continue
+            #
+
+            path = self.paths.get(wd)
+            if mask & self.IN_IGNORED:
+                self.paths.pop(wd, None)
+                if path is not None and self.wds.get(path) == wd:
+                    del self.wds[path]
+                #
+            #
+            if path is not None:
+                events.append((path, mask, get_unicode(name)))
+            #
+        #
+
+        return events
+    #
+
+    def close(self):
+        """"""
+
+        os.close(self.fd)
+        self.paths, self.wds = {}, {}
+    #
+#
+
+
+def norm_root(root):
+    """ return root without trailing separators (keys of files are the same for "path" and "path/")
+
+        :param root:
+    """
+
+    return root.rstrip(os.sep) or root[:1]
+#
+
+
+class Fs(object):
+    """ file system """
+
+    def __init__(self, root="./", full_include=None, meta_a_include=None, meta_p_include=None):
+        """
+            :param root:
+            :param full_include: suffixes of files with saved data (None - default)
+            :param meta_a_include: suffixes of audio files (None - default)
+            :param meta_p_include: suffixes of picture files (None - default)
+        """
+
+        self.root = None
+        self.root_u = None
+        self.files = None
+        self.index = None
+        self.deleted = None
+        self.md5name = None
+        # query index: FsQuery(), loader of saved FsQuery() or None (built from records on demand)
+        self.queries = None
+        # files by stat (see stat_index()): dict, loader of saved dict or FsDbStats()
+        self.stats = None
+
+        self.full_include = full_include or (".log", ".cue", ".accurip", ".xml", ".json", ".txt", ".lst", ".dump")
+        self.meta_a_include = meta_a_include or EXTRACTORS["meta_a"].suffixes
+        self.meta_p_include = meta_p_include or EXTRACTORS["meta_p"].suffixes
+
+        # suffix -> class (lower-case): other classes of extractors by registered suffixes
+        classes = dict((name, extractor.suffixes) for name, extractor in EXTRACTORS.iteritems())
+        classes.update({"full": self.full_include, "meta_a": self.meta_a_include, "meta_p": self.meta_p_include})
+        self.suffixes = mk_suffixes(classes)
+
+        # max size of kept "full" data (bigger files are saved as md5 & size only)
+        self.full_limit = 16 << 20
+
+        # content hash for audio (hash name or "auto", None - disabled)
+        self.content_hash = None
+
+        self.updated = False
+        self.autosave = True
+        self.incremental = False
+
+        self.set_root(root)
+    #
+
+    def __len__(self):
+        """
+            :return: total file(s) in fs
+        """
+
+        return len(self.files) if self.files else 0
+    #
+
+    def chg_root(self, root):
+        """ change root
+
+            :param root:
+            :return:
+        """
+
+        root = norm_root(root)
+        self.root = root
+        self.root_u = get_unicode(root)
+        self.md5name = hashlib.md5(self.root_u.encode('utf-8')).hexdigest()+".fs"
+        self.updated = True
+    #
+
+    def set_root(self, root):
+        """ set new root
+
+            :param root:
+        """
+
+        # sane
+        root = norm_root(root or "./")
+
+        self.root = root
+        self.root_u = get_unicode(root)
+        self.files = {}
+        self.index = {}
+        self.queries = None
+        self.stats = None
+        self.deleted = []
+        self.md5name = hashlib.md5(self.root_u.encode('utf-8')).hexdigest()+".fs"
+        self.updated = False
+
+        return self
+    #
+
+    def sign(self, hashfunc=hashlib.md5):
+        """ generate signature for Fs(): sum of signatures of names (independent of order)
+
+            for md5 the sum is kept in self.index["sign"] and updated by scan (see sign_update())
+
+            :param hashfunc: hash function
+            :return:
+        """
+
+        size = hashfunc().digest_size * 8
+
+        if hashfunc is hashlib.md5:
+            total = self.index.get("sign")
+            if total is None:
+                total = self.index["sign"] = sum(sign_name(name) for name in self.files) % (1 << size)
+            #
+        else:
+            total = sum(sign_name(name, hashfunc) for name in self.files)
+        #
+
+        return binascii.a2b_hex("%0*x" % (size // 4, total % (1 << size)))
+    #
+
+    def sign_update(self, name, add=True):
+        """ update signature by added/removed name (if signature is calculated)
+
+            :param name:
+            :param add: name is added (or removed)
+        """
+
+        total = self.index.get("sign")
+        if total is not None:
+            total += sign_name(name) if add else -sign_name(name)
+            self.index["sign"] = total % (1 << 128)
+        #
+    #
+
+    def hex_sign(self):
+        """ generate hex-signature for Fs()
+
+            :return:
+        """
+
+        return binascii.b2a_hex(self.sign())
+    #
+
+    def classify(self, name):
+        """ return class of file by suffix (case-insensitive): "full", "meta_a", "meta_p" (None - unknown)
+
+            :param name: file name (or path)
+        """
+
+        return self.suffixes.get(os.path.splitext(name)[1].lower())
+    #
+
+    @staticmethod
+    def suffix_class(path, suffs_class):
+        """ check by suffix
+
+            :param path:
+            :param suffs_class:
+        """
+
+        for name, suffs in suffs_class.iteritems():
+            for suff in suffs:
+                if path.endswith(suff):
+                    return name, suff
+                #
+            #
+        #
+
+        return None
+    #
+
+    def scan(self, start=None, callback=None, workers=0, pool="thread", deep=False, recursive=True):
+        """ file scanner
+
+            in incremental mode (self.incremental) unchanged folders (by stat of folder) are not listed and
+            their files are not stat'ed (the saved listing is used), only sub-folders are checked
+
+            :param start:
+            :param callback:
+            :param workers: total workers for data/meta-data loading (0 - load in-place)
+            :param pool: workers pool mode ("thread" or "process")
+            :param deep: force deep verification (ignore incremental mode)
+            :param recursive: check sub-folders of unchanged folders (for incremental mode)
+        """
+
+        opts = {"full_limit": self.full_limit}
+        jobs = []
+
+        # changed folders (for merkle hashes)
+        dirty = set()
+        # query index is updated if it's saved/built (otherwise it's built on demand)
+        query = self.query_index(build=False)
+
+        # files by stat: (size, mtime, inode) -> name, content hash & meta-data of moved/copied file are
+        # read from record (caches of old snapshots are kept in index)
+        for key in ("hash", "meta", "meta_name"):
+            self.index.pop(key, None)
+        #
+        stats = self.stat_index()
+        # keys of purged files (are dropped after scan, if not used by moved files)
+        stale, used = set(), set()
+        # purged records (sources of content hash & meta-data for moved files)
+        purged = {}
+        peek = getattr(self.files, "peek", self.files.get)
+        if self.content_hash:
+            opts["content_hash"] = hash_algo(self.content_hash)
+        #
+
+        def stat_key(st):
+            """ cache key for file
+
+                :param st:
+            """
+
+            return st.st_size, st.st_mtime, st.st_ino
+        #
+
+        def save(f_name, f):
+            """ save file
+
+                :param f_name:
+                :param f:
+            """
+
+            if callback:
+                f = callback("save", f)
+            #
+
+            if f:
+                f_old = self.files.get(f_name)
+                if f_old is None:
+                    self.sign_update(f_name)
+                elif query:
+                    query.remove(f_name, f_old)
+                #
+                if query:
+                    query.add(f_name, f)
+                #
+                self.files[f_name] = f
+                self.updated = True
+                dirty.add(os.path.dirname(f_name))
+                if f.hash or (f.meta and "error" not in f.meta):
+                    stats[stat_key(f.stat)] = f_name
+                #
+            #
+        #
+
+        def purge(f_name):
+            """ purge file (folder with all files)
+
+                :param f_name:
+            """
+
+            f = self.files.pop(f_name, None)
+            if f is None:
+                return
+            #
+
+            self.sign_update(f_name, add=False)
+            if query:
+                query.remove(f_name, f)
+            #
+            dirty.add(os.path.dirname(f_name))
+            stale.add(stat_key(f.stat))
+            purged[f_name] = f
+            self.deleted.append(f)
+            self.updated = True
+            if callback:
+                callback("purge", f)
+            #
+
+            if f.type == "DIR":
+                for name in f.data:
+                    purge(os.path.join(f_name, name))
+                #
+            #
+        #
+
+        def skipper(o_path, path, d_old):
+            """ skip unchanged folder
+
+                :param o_path: folder
+                :param path: folder (relative to root)
+                :param d_old: saved folder
+                :return: list of (sub-folder, stat)
+            """
+
+            folders = []
+
+            for name, st in d_old.data.iteritems():
+                if stat.S_ISDIR(st.st_mode):
+                    # re-check sub-folder (folder stat isn't changed by changes in sub-folder)
+                    _name = os.path.join(o_path, name)
+                    try:
+                        st = os.lstat(_name)
+                    except OSError:
+                        continue
+                    #
+                    if stat.S_ISDIR(st.st_mode):
+                        folders.append((_name, st))
+                    #
+                elif callback:
+                    f = self.files.get(os.path.join(path, name))
+                    if f:
+                        callback("skip", f)
+                    #
+                #
+            #
+
+            folders.reverse()
+            return folders
+        #
+
+        def collector(o_path, path, o_stat, entries):
+            """ collector
+
+                :param o_path: folder
+                :param path: folder (relative to root)
+                :param o_stat: folder stat
+                :param entries: folder entries (from list_dir())
+            """
+
+            names = dict((name, FsStat.make(st)) for name, st, _ in entries)
+
+            # find deleted files
+            d_old = self.files.get(path)
+            if d_old:
+                for name in d_old.data:
+                    if name not in names:
+                        purge(os.path.join(path, name))
+                    #
+                #
+            #
+
+            # load info from folder (keep unchanged record)
+            if not d_old or not is_same_folder(d_old.stat, o_stat) or d_old.data != names:
+                f = FsFile(path, "", o_stat)
+                f.data = names
+                f.type = "DIR"
+                if not d_old:
+                    self.sign_update(path)
+                #
+                self.files[path] = f
+                dirty.add(path)
+            #
+
+            for name, st, _ in entries:
+                _name = os.path.join(o_path, name)
+                f_name = os.path.join(path, name)
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                #
+
+                f = FsFile(path, name, st)
+                f_old = self.files.get(f_name)
+
+                if f_old:
+                    if f.stat.st_mtime == f_old.stat.st_mtime:
+                        algo = opts.get("content_hash")
+                        if algo and not (f_old.hash or "").startswith("%s:" % algo) and \
+                                self.classify(name) == "meta_a":
+                            # unchanged file without content hash (of current algorithm): hash only
+                            f_old.hash = None
+                            if workers:
+                                jobs.append((f_name, (_name, f_old, "meta_a", opts)))
+                            else:
+                                save(f_name, load_file((_name, f_old, "meta_a", opts)))
+                            #
+                            continue
+                        #
+                        if callback:
+                            callback("skip", f)
+                        #
+                        continue
+                    #
+                    stats.pop(stat_key(f_old.stat), None)
+                #
+
+                # record of the same file (moved/copied)
+                key = stat_key(st)
+                used.add(key)
+                src = stats.get(key)
+                f_src = purged.get(src) or (peek(src) if src in self.files else None) if src else None
+                if f_src and stat_key(f_src.stat) != key:
+                    f_src = None
+                #
+
+                # cached content hash
+                f.hash = f_src.hash if f_src else None
+                if f.hash and not f.hash.startswith("%s:" % opts.get("content_hash")):
+                    f.hash = None
+                #
+
+                _class = self.classify(name)
+
+                # cached meta-data (extractor isn't called)
+                if _class in EXTRACTORS and f_src and f_src.meta and "error" not in f_src.meta:
+                    f.tags, f.meta = f_src.tags, f_src.meta
+                    f.md5 = get_hex(f.meta.get("md5_signature"), size=32)
+                    if not (_class == "meta_a" and opts.get("content_hash") and not f.hash):
+                        _class = None
+                    #
+                #
+
+                if not _class:
+                    save(f_name, f)
+                elif workers:
+                    # defer loading (to workers)
+                    jobs.append((f_name, (_name, f, _class, opts)))
+                else:
+                    save(f_name, load_file((_name, f, _class, opts)))
+                #
+            #
+        #
+
+        # scanning from
+        if not start:
+            start = ""
+        #
+
+        self.deleted = []
+
+        tt = time.time()
+        incremental = self.incremental and not deep
+
+        # walk top-down (folder stat is taken from parent listing)
+        top = os.path.join(self.root_u, start)
+        stack = [(top, os.stat(top))]
+        while stack:
+            o_path, o_stat = stack.pop()
+            path = o_path.partition(self.root_u)[2]
+
+            # start folder is always listed (for watch: changes of files don't change folder stat)
+            if incremental and o_path != top:
+                d_old = self.files.get(path)
+                if d_old and d_old.type == "DIR" and is_same_folder(d_old.stat, o_stat):
+                    if recursive:
+                        stack.extend(skipper(o_path, path, d_old))
+                    #
+                    continue
+                #
+            #
+
+            try:
+                entries = list_dir(o_path)
+            except OSError:
+                continue
+            #
+
+            collector(o_path, path, o_stat, entries)
+            stack.extend((os.path.join(o_path, name), st) for name, st, is_dir in reversed(entries) if is_dir)
+        #
+
+        # load data/meta-data by workers (results are saved in scanning order)
+        if jobs:
+            workers_pool = mk_pool(workers, pool)
+            try:
+                results = workers_pool.imap(load_file, [job for _, job in jobs], chunksize=16)
+                for (f_name, _), f in itertools.izip(jobs, results):
+                    save(f_name, f)
+                #
+            finally:
+                workers_pool.terminate()
+            #
+        #
+
+        for key in stale - used:
+            stats.pop(key, None)
+        #
+
+        # merkle hashes: changed folders and their parents (all folders for snapshot without hashes)
+        self.merkle(dirty if self.index.get("merkle") else None)
+
+        return time.time() - tt
+    #
+
+    def watch(self, callback=None, workers=0, pool="thread", delay=1.0, checkpoint=300.0, snapshot=None,
+              fmt="pickle", codec=None, level=None, duration=None):
+        """ watch root by inotify: changed folders are rescanned (incrementally) in batches
+
+            events are collected until there are no new events for delay seconds, all folders of batch are
+            rescanned by scan() (records, hashes and indexes are updated as for scan),
+            snapshot is saved (by dump()) not often than every checkpoint seconds (and at exit)
+
+            :param callback: scan callback
+            :param workers: total scan workers
+            :param pool: scan workers pool mode
+            :param delay: debounce delay (seconds)
+            :param checkpoint: checkpoint interval (seconds)
+            :param snapshot: .fs for checkpoints (None - no checkpoints)
+            :param fmt: snapshot format
+            :param codec: snapshot codec
+            :param level: snapshot compression level
+            :param duration: stop after duration seconds (None - run until interrupted)
+        """
+
+        def start_of(folder):
+            """ scan start for folder (relative to root) """
+
+            return folder.partition(self.root_u)[2].lstrip(os.sep)
+        #
+
+        def sync_watches():
+            """ watch all folders (by DIR records) """
+
+            folders = set(self.real_path(name) for name, _, _, _, f_type in self.listing() if f_type == "DIR")
+            for folder in set(inotify.wds) - folders:
+                inotify.remove(folder)
+            #
+            for folder in folders - set(inotify.wds):
+                inotify.add(folder)
+            #
+        #
+
+        def save():
+            """ checkpoint """
+
+            if snapshot and self.updated:
+                self.dump(snapshot, pack=True, fmt=fmt, codec=codec, level=level)
+            #
+        #
+
+        self.incremental = True
+        inotify = Inotify()
+        stop = time.time() + duration if duration is not None else None
+        saved = time.time()
 
-        :param n:
-        :param size:
-        :param radix:
-    """
+        try:
+            self.scan(callback=callback, workers=workers, pool=pool)
+            sync_watches()
+
+            dirty = set()
+            while stop is None or time.time() < stop:
+                timeout = delay if dirty else checkpoint
+                if stop is not None:
+                    timeout = max(0.0, min(timeout, stop - time.time()))
+                #
 
-    if n is None:
-        return None
-    #
+                # removed/moved folder is rescanned by event of parent
+                events = inotify.read(timeout)
+                for folder, _, _ in events:
+                    dirty.add(folder)
+                #
 
-    a = []
+                if dirty and not events:
+                    # batch is ready (queue overflow: rescan all)
+                    if None in dirty:
+                        self.scan(callback=callback, workers=workers, pool=pool)
+                    else:
+                        for folder in sorted(dirty, key=len):
+                            if os.path.isdir(folder):
+                                self.scan(start=start_of(folder), callback=callback, workers=workers, pool=pool,
+                                          recursive=False)
+                            #
+                        #
+                    #
+                    dirty = set()
+                    sync_watches()
+                #
 
-    while True:
-        n, r = divmod(n, 16)
-        a.append(r)
-        if not n:
-            if not size or len(a) >= size:
-                break
+                if time.time() - saved >= checkpoint:
+                    save()
+                    saved = time.time()
+                #
             #
+        finally:
+            inotify.close()
+            save()
         #
     #
 
-    a.reverse()
-    return "".join([radix[n] for n in a])
-#
-
+    def merkle(self, dirty=None):
+        """ update merkle hashes of folders (kept in md5 of DIR records): md5 of sorted leafs of folder
+            (see merkle_leaf()), folders are updated bottom-up
 
-class Fs(object):
-    """ file system """
+            :param dirty: changed folders (parents are updated too), None - all folders
+        """
 
-    def __init__(self, root="./"):
-        """"""
+        files = self.files
+        peek = getattr(files, "peek", files.__getitem__)
 
-        self.root = None
-        self.root_u = None
-        self.files = None
-        self.index = None
-        self.deleted = None
-        self.md5name = None
+        if dirty is None:
+            dirty = [name for name, _, _, _, f_type in self.listing() if f_type == "DIR"]
+        #
 
-        self.full_include = (".log", ".cue", ".accurip", ".xml", ".json", ".txt", ".lst", ".dump")
-        self.meta_a_include = (".flac", ".ape", ".wv", ".mp3", ".opus", ".ogg")
-        self.meta_p_include = (".bmp", ".jpg", ".jpeg", ".gif", ".png", ".tif", ".tiff")
+        todo = set()
+        for path in dirty:
+            while path not in todo and path in files:
+                todo.add(path)
+                parent = os.path.dirname(path)
+                if parent == path:
+                    break
+                #
+                path = parent
+            #
+        #
 
-        self.updated = False
-        self.autosave = True
+        # children keys are longer than parent key
+        for path in sorted(todo, key=len, reverse=True):
+            d = peek(path)
+            h = hashlib.md5()
+            for name in sorted(d.data):
+                f_name = os.path.join(path, name)
+                if f_name in files:
+                    h.update(merkle_leaf(name, peek(f_name)))
+                #
+            #
+            md5 = h.hexdigest()
+            if d.md5 != md5:
+                d.md5 = md5
+                files[path] = d
+                self.updated = True
+            #
+        #
 
-        self.set_root(root)
+        self.index["merkle"] = 1
     #
 
-    def __len__(self):
-        """
-            :return: total file(s) in fs
+    def query_index(self, build=True):
+        """ return query index (saved index is loaded on demand, built from records for snapshot without index)
+
+            :param build: build index from records (False - return None for snapshot without index)
+            :return: FsQuery() (or FsDbQuery())
         """
 
-        return len(self.files) if self.files else 0
+        query = self.queries
+        if callable(query):
+            query = query()
+        #
+        if query is None and build:
+            query = FsQuery()
+            for name, f in self.iter_files():
+                query.add(name, f)
+            #
+        #
+
+        self.queries = query
+        return query
     #
 
-    def chg_root(self, root):
-        """ change root
+    def stat_index(self):
+        """ return files by stat: (size, mtime, inode) -> name (saved index is loaded on demand)
 
-            :param root:
-            :return:
+            :return: dict (or FsDbStats())
         """
 
-        self.root = root
-        self.root_u = get_unicode(root)
-        self.md5name = hashlib.md5(self.root_u.encode('utf-8')).hexdigest()+".fs"
-        self.updated = True
-    #
+        stats = self.stats
+        if callable(stats):
+            stats = stats()
+        #
 
-    def set_root(self, root):
-        """ set new root
+        self.stats = {} if stats is None else stats
+        return self.stats
+    #
 
-            :param root:
+    def saved_stats(self):
+        """ return files by stat to be saved with snapshot (None for sqlite store)
         """
 
-        # sane
-        root = root or "./"
+        stats = self.stat_index()
+        return stats if isinstance(stats, dict) else None
+    #
 
-        self.root = root
-        self.root_u = get_unicode(root)
-        self.files = {}
-        self.index = {}
-        self.deleted = []
-        self.md5name = hashlib.md5(self.root_u.encode('utf-8')).hexdigest()+".fs"
-        self.updated = False
+    def saved_query(self):
+        """ return query index to be saved with snapshot (None if not loaded/built)
+        """
 
-        return self
+        query = self.query_index(build=False)
+        return query if isinstance(query, FsQuery) else None
     #
 
-    def sign(self, hashfunc=hashlib.md5):
-        """ generate signature for Fs()
+    def query(self, conds):
+        """ find files by conditions (see FsQuery.find())
 
-            :param hashfunc: hash function
-            :return:
+            :param conds: list of (field, op, value) or "field<op>value"
+            :return: sorted list of names
         """
 
-        raw_data = "\x00".join([get_bytes(name, 'utf-8') for name in self.files.keys()])
-        return hashfunc(raw_data).digest()
+        conds = [parse_query(cond) if isinstance(cond, basestring) else cond for cond in conds]
+        return sorted(self.query_index().find(conds))
     #
 
-    def hex_sign(self):
-        """ generate hex-signature for Fs()
+    def top(self):
+        """ return key of top folder
 
             :return:
         """
 
-        return binascii.b2a_hex(self.sign())
+        top = os.path.join(self.root_u, "").partition(self.root_u)[2]
+        if top not in self.files and "" in self.files:
+            # snapshot of root with trailing separator (made before roots were normalized)
+            top = ""
+        #
+
+        return top
     #
 
-    @staticmethod
-    def suffix_class(path, suffs_class):
-        """ check by suffix
+    def real_path(self, name):
+        """ return path of file in file system
 
-            :param path:
-            :param suffs_class:
+            :param name: name of file (key in self.files)
         """
 
-        for name, suffs in suffs_class.iteritems():
-            for suff in suffs:
-                if path.endswith(suff):
-                    return name, suff
-                #
-            #
-        #
-
-        return None
+        return self.root_u + name
     #
 
-    def scan(self, start=None, callback=None):
-        """ file scanner
+    def iter_files(self):
+        """ iterate files (sorted by name), for snapshot records aren't kept in memory
 
-            :param start:
-            :param callback:
+            :return: generator of (name, FsFile())
         """
 
-        _suffix = {"full": self.full_include, "meta_a": self.meta_a_include, "meta_p": self.meta_p_include}
-        metafun = {"meta_a": load_audio_meta, "meta_p": load_picture_meta}
+        peek = getattr(self.files, "peek", self.files.__getitem__)
 
-        def collector(arg, path, names):
-            """ collector
+        for name in sorted(self.files):
+            yield name, peek(name)
+        #
+    #
 
-                :param arg:
-                :param path:
-                :param names:
-            """
+    def listing(self):
+        """ list files (sorted by name), for snapshot records aren't loaded
 
-            updated = False
-            o_path = path
-            root, _, path = path.partition(arg.root_u)
+            :return: generator of (name, file size, file mtime, md5, type)
+        """
 
-            # find deleted files
-            d_old = arg.files.get(path)
-            if d_old:
-                for name in d_old.data:
-                    if name not in names:
-                        fname = os.path.join(path, name)
-                        f = arg.files.pop(fname)
-                        self.deleted.append(f)
-                        updated = True
-                        if callback:
-                            callback("purge", f)
-                        #
-                        if f.type == "DIR":
-                            for _name in f.data:
-                                f = arg.files.pop(os.path.join(fname, _name))
-                                self.deleted.append(f)
-                                if callback:
-                                    callback("purge", f)
-                                #
-                            #
-                        #
-                    #
-                #
-            #
+        info = getattr(self.files, "info", None)
 
-            # load info from folder
-            if os.path.isdir(o_path):
-                f = FsFile(path, "", os.stat(o_path))
-                data = {}
-                for fname in os.listdir(o_path):
-                    data[fname] = os.stat(os.path.join(o_path, fname))
-                #
-                f.data = data
-                f.type = "DIR"
-                arg.files[path] = f
+        for name in sorted(self.files):
+            if info:
+                size, mtime, md5, f_type = info(name)
+            else:
+                f = self.files[name]
+                size, mtime, md5, f_type = f.stat.st_size, f.stat.st_mtime, f.md5, f.type
             #
+            yield name, size, mtime, md5, f_type
+        #
+    #
 
-            for name in names:
-                _name = os.path.join(o_path, name)
-                f_name = os.path.join(path, name)
-                if not os.path.isfile(_name):
-                    continue
-                #
+    def write(self, fp, codec="zlib", level=None):
+        """ write indexed snapshot (records are packed one-by-one, index of records is saved at end)
 
-                f = FsFile(path, name, os.stat(_name))
-                f_old = arg.files.get(f_name)
+            :param fp: file (seekable)
+            :param codec: records/index codec
+            :param level: compression level
+        """
 
-                if f_old:
-                    if f.stat.st_mtime == f_old.stat.st_mtime:
-                        if callback:
-                            callback("skip", f)
-                        #
-                        continue
-                    #
-                #
+        start = fp.tell()
+        fp.write(FS_HEADER.pack(FS_MAGIC, codec, 0, 0))
 
-                _suff = self.suffix_class(f_name, _suffix)
-                if _suff:
-                    _class, suff = _suff
-                    if _class == "full":
-                        f.data = open(_name, "rb").read()
-                        f.md5 = hashlib.md5(f.data).hexdigest()
-                    elif _class.startswith("meta"):
-                        fn = metafun[_class]
-                        if callable(fn):
-                            f.tags, f.meta = fn(_name)
-                            f.md5 = get_hex(f.meta.get("md5_signature"), size=32)
-                        #
-                    #
-                #
+        # unchanged records are copied as-is (for the same codec)
+        raw = getattr(self.files, "raw", None)
+        if getattr(self.files, "codec", None) != codec:
+            raw = None
+        #
 
-                if callback:
-                    f = callback("save", f)
+        entries = []
+        offset = FS_HEADER.size
+
+        for name in sorted(self.files):
+            data = raw(name) if raw else None
+            f = None
+            blob = False
+            if data is None:
+                f = self.files[name]
+                f_data = f.data
+                f_type = f.type
+                if isinstance(f_data, FsData):
+                    blob = f_data.loaded()
+                    if blob is None:
+                        # source is changed/removed after scan: saved as "REF" (see FsFile.__getstate__())
+                        f_type, blob = "REF", False
+                    else:
+                        # data is saved as blob (record keeps pointer only)
+                        fp.write(blob)
+                        f.data = FsData(f_data.size, f_data.md5, offset=offset)
+                        offset += len(blob)
+                        blob = True
+                    #
                 #
-
-                if f:
-                    arg.files[f_name] = f
-                    updated = True
+                try:
+                    data = pack_data(pickle.dumps(f, protocol=-1), codec, level)
+                finally:
+                    f.data = f_data
                 #
             #
 
-            if updated:
-                arg.updated = True
+            if f is None:
+                size, mtime, md5, f_type = self.files.info(name)
+                entries.append((name, offset, len(data), size, mtime, md5, False, f_type))
+            else:
+                entries.append((name, offset, len(data), f.stat.st_size, f.stat.st_mtime, f.md5, blob, f_type))
             #
-        #
 
-        # scanning from
-        if not start:
-            start = ""
+            fp.write(data)
+            offset += len(data)
         #
 
-        self.deleted = []
+        # query index & files by stat are saved as separate sections (loaded on demand)
+        sections = []
+        for section in (self.saved_query(), self.saved_stats()):
+            entry = None
+            if section is not None:
+                data = pack_data(pickle.dumps(section, protocol=-1), codec, level)
+                fp.write(data)
+                entry = offset, len(data)
+                offset += len(data)
+            #
+            sections.append(entry)
+        #
 
-        tt = time.time()
-        os.path.walk(os.path.join(self.root_u, start), collector, self)
+        state = (self.root, self.index, entries) + tuple(sections)
+        index = pack_data(pickle.dumps(state, protocol=-1), codec, level)
+        fp.write(index)
 
-        return time.time() - tt
+        end = fp.tell()
+        fp.seek(start)
+        fp.write(FS_HEADER.pack(FS_MAGIC, codec, offset, len(index)))
+        fp.seek(end)
     #
 
-    def dumps(self, pack=True):
-        """ dump files into pickle-string
+    def dumps(self, pack=True, fmt="pickle", codec=None, level=None):
+        """ dump files into pickle-string (or indexed snapshot)
 
-            :param pack:
+            :param pack: use default codec ("bz2" for pickle) if codec isn't set
+            :param fmt: "pickle" or "index"
+            :param codec: "none", "zlib", "bz2" or "lzma"
+            :param level: compression level (None - default for codec)
         """
 
-        data = pickle.dumps((self.root, self.index, self.files), protocol=-1)
-
-        if pack:
-            data = bz2.compress(data, 9)
+        if fmt == "index":
+            fp = StringIO()
+            self.write(fp, codec=codec or "zlib", level=level)
+            return fp.getvalue()
         #
 
-        return data
+        files = self.files if isinstance(self.files, dict) else dict(self.files.iteritems())
+        data = pickle.dumps((self.root, self.index, files, self.saved_query(), self.saved_stats()), protocol=-1)
+
+        return pack_data(data, codec or ("bz2" if pack else "none"), level)
+    #
+
+    @staticmethod
+    def section(data, entry, codec):
+        """ return loader of section of indexed snapshot
+
+            :param data: snapshot data
+            :param entry: (offset, size)
+            :param codec:
+        """
+
+        offset, size = entry
+        return lambda: pickle.loads(unpack_data(data[offset:offset + size], codec))
     #
 
     def loads(self, data):
-        """ load files from pickle-string
+        """ load files from pickle-string (or indexed snapshot), codec is detected by magic
 
-            :param data:
+            :param data: string or mmap
         """
 
-        if data.startswith('BZ'):
-            data = bz2.decompress(data)
+        if data[:len(FS_MAGIC)] == FS_MAGIC:
+            _, codec, offset, size = FS_HEADER.unpack(data[:FS_HEADER.size])
+            codec = codec.rstrip("\x00")
+            state = pickle.loads(unpack_data(data[offset:offset + size], codec))
+            root, index, entries = state[:3]
+            self.set_root(root)
+            self.index, self.files = index, FsFiles(data, entries, codec)
+            # query index (saved in index by old versions) & files by stat
+            self.queries = self.index.pop("query", None)
+            if len(state) > 3 and state[3]:
+                self.queries = self.section(data, state[3], codec)
+            #
+            if len(state) > 4 and state[4]:
+                self.stats = self.section(data, state[4], codec)
+            #
+            return self
         #
 
-        root, index, files = pickle.loads(data)
+        state = pickle.loads(unpack_data(data))
+        root, index, files = state[:3]
         self.set_root(root)
         self.index, self.files = index, files
+        self.queries = state[3] if len(state) > 3 else self.index.pop("query", None)
+        self.stats = state[4] if len(state) > 4 else None
         return self
     #
 
-    def dump(self, name=None, pack=None):
+    def dump(self, name=None, pack=None, fmt="pickle", codec=None, level=None):
         """ save object data
 
             :param name:
             :param pack:
+            :param fmt: "pickle", "index" or "sqlite"
+            :param codec: "none", "zlib", "bz2" or "lzma"
+            :param level: compression level
         """
 
         if not name:
             name = self.md5name
         #
 
-        with open(name, "wb") as f:
-            f.write(self.dumps(pack=pack))
+        # current snapshot can be memory-mapped (or used as sqlite store) by self.files:
+        # write to temporary file, then replace
+        t_name = name + ".tmp"
+        if os.path.exists(t_name):
+            os.remove(t_name)
+        #
+
+        if fmt == "sqlite":
+            db = getattr(self.files, "db", None)
+            if db and os.path.exists(name) and os.path.samefile(db.name, name):
+                # loaded from the same store: write changes only (single transaction)
+                self.files.flush(self.root, self.index)
+                t_name = None
+            else:
+                db = FsDb(t_name)
+                db.write(self.root, self.index, self.files.iteritems(), full=True)
+                db.db.close()
+            #
+        elif fmt == "index":
+            with open(t_name, "wb") as f:
+                self.write(f, codec=codec or "zlib", level=level)
+            #
+        else:
+            data = self.dumps(pack=pack, codec=codec, level=level)
+            with open(t_name, "wb") as f:
+                f.write(data)
+            #
+        #
+
+        if t_name:
+            os.rename(t_name, name)
         #
 
         self.updated = False
@@ -441,7 +2980,7 @@ class Fs(object):
     #
 
     def load(self, name=None, ignore=False):
-        """ load object data
+        """ load object data (indexed snapshot is memory-mapped, sqlite store is used as-is)
 
             :param name:
             :param ignore:
@@ -453,7 +2992,21 @@ class Fs(object):
 
         try:
             with open(name, "rb") as f:
-                self.loads(f.read())
+                magic = f.read(len(DB_MAGIC))
+                if magic.startswith(FS_MAGIC):
+                    self.loads(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                elif magic == DB_MAGIC:
+                    db = FsDb(name)
+                    root, index = db.info()
+                    self.set_root(root or "./")
+                    self.index, self.files = index, FsDbFiles(db)
+                    self.index.pop("query", None)
+                    self.queries = FsDbQuery(self.files)
+                    self.stats = FsDbStats(db)
+                else:
+                    f.seek(0)
+                    self.loads(f.read())
+                #
             #
         except IOError:
             if not ignore:
@@ -490,12 +3043,18 @@ class Fs(object):
 #
 
 
-def mk_fs(name, basename=None, callback=None):
+def mk_fs(name, basename=None, callback=None, workers=0, pool="thread", snapshot=None, deep=False,
+          content_hash=None):
     """ make fs
 
         :param name:
         :param basename:
         :param callback:
+        :param workers: total scan workers
+        :param pool: scan workers pool mode
+        :param snapshot: previous .fs for incremental scan (if exists)
+        :param deep: force deep verification for incremental scan
+        :param content_hash: content hash for audio (hash name or "auto")
         :return:
     """
 
@@ -504,7 +3063,15 @@ def mk_fs(name, basename=None, callback=None):
     #
 
     fs = Fs(root=name)
-    fs.scan(callback=callback)
+    fs.content_hash = content_hash
+
+    if snapshot:
+        fs.load(snapshot, ignore=True)
+        fs.chg_root(name)
+        fs.incremental = True
+    #
+
+    fs.scan(callback=callback, workers=workers, pool=pool, deep=deep)
 
     if basename:
         # change root to basename
@@ -515,6 +3082,220 @@ def mk_fs(name, basename=None, callback=None):
 #
 
 
+def fs_diff(old, new, folders=False):
+    """ compare two Fs() by name, size, mtime and md5 (merge of sorted listings)
+
+        added/removed files with the same (size, md5) (or (size, mtime) without md5) are reported as moved,
+        only added/removed files are kept in memory (for moves)
+
+        :param old: Fs()
+        :param new: Fs()
+        :param folders: compare folders too
+        :return: generator of (op, old name, new name), op: "added", "removed", "modified", "moved"
+    """
+
+    def files(fs):
+        """ listing (names of snapshot made before roots were normalized get leading separator) """
+
+        legacy = fs.top() == ""
+        for entry in fs.listing():
+            if folders or entry[4] != "DIR":
+                yield (os.sep + entry[0],) + entry[1:] if legacy else entry
+            #
+        #
+    #
+
+    def key(entry):
+        """ key for move detection """
+
+        _, size, mtime, md5, _ = entry
+        return (size, md5) if md5 else (size, mtime)
+    #
+
+    added = collections.defaultdict(list)
+    removed = collections.defaultdict(list)
+
+    old_iter, new_iter = files(old), files(new)
+    o, n = next(old_iter, None), next(new_iter, None)
+
+    while o is not None or n is not None:
+        if n is None or (o is not None and o[0] < n[0]):
+            removed[key(o)].append(o[0])
+            o = next(old_iter, None)
+        elif o is None or n[0] < o[0]:
+            added[key(n)].append(n[0])
+            n = next(new_iter, None)
+        else:
+            if o[1:4] != n[1:4]:
+                yield "modified", o[0], n[0]
+            #
+            o, n = next(old_iter, None), next(new_iter, None)
+        #
+    #
+
+    changes = []
+    for k, names in removed.iteritems():
+        moved = added.pop(k, [])
+        for name in names:
+            changes.append(("moved", name, moved.pop(0)) if moved else ("removed", name, None))
+        #
+        if moved:
+            added[k] = moved
+        #
+    #
+
+    for change in sorted(changes, key=lambda x: x[1]):
+        yield change
+    #
+
+    for name in sorted(itertools.chain(*added.values())):
+        yield "added", None, name
+    #
+#
+
+
+def fs_verify(old, new):
+    """ compare two Fs() by merkle hashes of folders: only sub-trees with different hashes are walked
+
+        :param old: Fs()
+        :param new: Fs()
+        :return: generator of (op, old name, new name), op: "added", "removed", "modified"
+    """
+
+    for fs in (old, new):
+        if not fs.index.get("merkle"):
+            fs.merkle()
+        #
+    #
+
+    old_peek = getattr(old.files, "peek", old.files.__getitem__)
+    new_peek = getattr(new.files, "peek", new.files.__getitem__)
+
+    stack = [(old.top(), new.top())]
+    while stack:
+        o_path, n_path = stack.pop()
+        o, n = old_peek(o_path), new_peek(n_path)
+        if o.md5 and o.md5 == n.md5:
+            continue
+        #
+
+        folders = []
+        for name in sorted(set(o.data) | set(n.data)):
+            o_name, n_name = os.path.join(o_path, name), os.path.join(n_path, name)
+            o_f = old_peek(o_name) if o_name in old.files else None
+            n_f = new_peek(n_name) if n_name in new.files else None
+
+            if o_f is None and n_f is None:
+                continue
+            elif n_f is None:
+                yield "removed", o_name, None
+            elif o_f is None:
+                yield "added", None, n_name
+            elif o_f.type == "DIR" and n_f.type == "DIR":
+                folders.append((o_name, n_name))
+            elif merkle_leaf(name, o_f) != merkle_leaf(name, n_f):
+                yield "modified", o_name, n_name
+            #
+        #
+
+        folders.reverse()
+        stack.extend(folders)
+    #
+#
+
+
+def fs_dups(fss, albums=True):
+    """ find duplicate files and albums (folders with the same set of audio tracks) over Fs()-s
+
+        files are grouped by md5 (or content hash), for files without md5 hash is calculated only if sizes
+        collide (from content hash of record or from file), listings are collected in temporary sqlite database
+
+        :param fss: list of Fs()
+        :param albums: find duplicate albums too
+        :return: dict: "files" -> [(hash, [(fs id, name, size), ...]), ...],
+                       "albums" -> [(sign, [(fs id, folder, size, tracks), ...]), ...],
+                       "reclaimable" -> bytes (files), "reclaimable_albums" -> bytes (albums)
+    """
+
+    # zero md5_signature (isn't calculated by encoder)
+    no_md5 = "0" * 32
+
+    db = sqlite3.connect("")
+    db.execute("CREATE TABLE f (fs INTEGER, name TEXT, dir TEXT, size INTEGER, hash TEXT, audio INTEGER)")
+
+    for fs_id, fs in enumerate(fss):
+        rows = ((fs_id, name, os.path.dirname(name), size, md5 if md5 != no_md5 else None,
+                 fs.classify(name) == "meta_a") for name, size, mtime, md5, f_type in fs.listing()
+                if f_type != "DIR" and size)
+        db.executemany("INSERT INTO f VALUES (?, ?, ?, ?, ?, ?)", rows)
+    #
+
+    db.execute("CREATE INDEX f_size ON f (size)")
+
+    # hash only files with collided sizes
+    sql = ("SELECT rowid, fs, name FROM f WHERE hash IS NULL AND size IN "
+           "(SELECT size FROM f GROUP BY size HAVING COUNT(*) > 1)")
+    hashes = []
+    for rowid, fs_id, name in db.execute(sql).fetchall():
+        fs = fss[fs_id]
+        f = getattr(fs.files, "peek", fs.files.__getitem__)(name)
+        f_hash = f.hash
+        if not f_hash and os.path.isfile(fs.real_path(name)):
+            f_hash = read_full(fs.real_path(name), limit=0)[1]
+        #
+        if f_hash:
+            hashes.append((f_hash, rowid))
+        #
+    #
+    db.executemany("UPDATE f SET hash = ? WHERE rowid = ?", hashes)
+    db.execute("CREATE INDEX f_hash ON f (hash)")
+
+    result = {"files": [], "albums": [], "reclaimable": 0, "reclaimable_albums": 0}
+
+    # duplicate files
+    sql = "SELECT hash FROM f WHERE hash IS NOT NULL GROUP BY hash HAVING COUNT(*) > 1"
+    for (f_hash,) in db.execute(sql).fetchall():
+        group = db.execute("SELECT fs, name, size FROM f WHERE hash = ? ORDER BY fs, name", (f_hash,)).fetchall()
+        result["files"].append((f_hash, group))
+        sizes = [size for _, _, size in group]
+        result["reclaimable"] += sum(sizes) - max(sizes)
+    #
+
+    if not albums:
+        return result
+    #
+
+    # duplicate albums: sign of sorted track hashes (folders with unhashed track are skipped)
+    db.execute("CREATE TABLE a (fs INTEGER, dir TEXT, sign TEXT, size INTEGER, tracks INTEGER)")
+
+    def folders():
+        """"""
+
+        sql = "SELECT fs, dir, hash, size FROM f WHERE audio ORDER BY fs, dir"
+        for (fs_id, folder), rows in itertools.groupby(db.execute(sql), lambda row: row[:2]):
+            rows = list(rows)
+            if all(row[2] for row in rows):
+                sign = hashlib.md5("\x00".join(sorted(row[2] for row in rows))).hexdigest()
+                yield fs_id, folder, sign, sum(row[3] for row in rows), len(rows)
+            #
+        #
+    #
+
+    db.executemany("INSERT INTO a VALUES (?, ?, ?, ?, ?)", list(folders()))
+
+    sql = "SELECT sign FROM a GROUP BY sign HAVING COUNT(*) > 1"
+    for (sign,) in db.execute(sql).fetchall():
+        group = db.execute("SELECT fs, dir, size, tracks FROM a WHERE sign = ? ORDER BY fs, dir", (sign,)).fetchall()
+        result["albums"].append((sign, group))
+        sizes = [size for _, _, size, _ in group]
+        result["reclaimable_albums"] += sum(sizes) - max(sizes)
+    #
+
+    db.close()
+    return result
+#
+
+
 def scan_print(cmd, f):
     """ print scanning process
 